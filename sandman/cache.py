@@ -0,0 +1,363 @@
+"""In-process caches used to avoid repeating work across requests."""
+
+import collections
+import os
+import random
+import sqlite3
+import threading
+import time
+
+_MISSING = object()
+
+# The key whose generation is moved on by writes to every resource of a
+# collection at once
+ALL_RESOURCES = '*'
+
+
+class LRUCache(object):
+    """A mapping holding at most *max_size* entries, which evicts the least
+    recently used entry first and counts its hits and misses. Entries
+    stored with :meth:`set` may also expire after a time-to-live.
+
+    Besides :meth:`get`, it supports the ``in``/``[]`` protocol SQLAlchemy
+    expects of a ``compiled_cache`` execution option.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value cached for *key* (marking it as most recently
+        used), or *default* if there is none."""
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self.misses += 1
+                return default
+            self._entries[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl=None):
+        """Cache *value* for *key*, for at most *ttl* seconds if given."""
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dictionary describing the cache's size and hit ratio.
+
+        :rtype: dict
+
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+
+class QueryCache(object):
+    """Cache of the SQL statements built for collection queries, keyed by
+    the *shape* of the query (the collection and the names, operators and
+    structure of its filter, sort and paging arguments) rather than by the
+    values being filtered on.
+
+    Reusing the same statement object for every query of a given shape lets
+    SQLAlchemy's ``compiled_cache`` skip compiling its SQL again; only the
+    bound parameters change between calls.
+    """
+
+    def __init__(self, max_size):
+        self.statements = LRUCache(max_size)
+        self.compiled = LRUCache(max_size)
+
+    def get(self, shape):
+        """Return the statement cached for *shape*, or ``None``."""
+        return self.statements.get(shape)
+
+    def set(self, shape, statement):
+        """Cache *statement* as the statement for queries of *shape*."""
+        self.statements[shape] = statement
+
+    def stats(self):
+        """Return the statement cache's hit and miss counts.
+
+        :rtype: dict
+
+        """
+        return self.statements.stats()
+
+
+class Generations(object):
+    """Write generations of collections and of individual resources, and the
+    times they were last written, held in this process.
+
+    The generations of individual resources are forgotten once there are
+    more than *max_size* of them; the *epoch* included in every stamp then
+    moves on, so that nothing stamped before can be mistaken as current.
+    The epoch starts at a random value, so that stamps (and the ETags derived
+    from them) aren't repeated after a restart. Anything not written since
+    the epoch started is taken to have been last modified when it did.
+
+    Bumping the key :data:`ALL_RESOURCES` of a collection moves on the
+    generation of every resource in it.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._epoch = random.getrandbits(32)
+        self._started = time.time()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _names(self, collection, key):
+        """Return the names of the generations *collection* (or the resource
+        with primary key *key* in it) depends on."""
+        if key is None:
+            return [collection]
+        return [(collection, ALL_RESOURCES), (collection, key)]
+
+    def stamp(self, collection, key=None):
+        """Return the current generation of *collection* (or of the resource
+        with primary key *key* in it)."""
+        with self._lock:
+            return (self._epoch,) + tuple(
+                self._generations.get(name, (0, None))[0] for name in
+                self._names(collection, key))
+
+    def last_modified(self, collection, key=None):
+        """Return the time (in seconds since the epoch) *collection* (or the
+        resource with primary key *key* in it) was last written."""
+        with self._lock:
+            return max(
+                self._generations.get(name, (0, self._started))[1] for name in
+                self._names(collection, key))
+
+    def bump(self, collection, key=None):
+        """Move on the generation of *collection* and, if *key* is given, of
+        the resource with that primary key."""
+        now = time.time()
+        with self._lock:
+            generations = [collection]
+            if key is not None:
+                generations.append((collection, key))
+            for generation in generations:
+                value, _ = self._generations.get(generation, (0, None))
+                self._generations[generation] = (value + 1, now)
+            if len(self._generations) > self.max_size:
+                self._generations.clear()
+                self._epoch += 1
+                self._started = now
+
+
+class SharedGenerations(object):
+    """Write generations kept in the SQLite database at *path*, so that every
+    process using the same file sees the writes made by the others.
+
+    Each process (and thread) uses its own connection; a generation is
+    moved on in a single ``IMMEDIATE`` transaction, and read with a single
+    ``SELECT``.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS generation ('
+                'collection TEXT NOT NULL, key TEXT NOT NULL, '
+                'value INTEGER NOT NULL, modified REAL NOT NULL, '
+                'PRIMARY KEY (collection, key))')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS epoch ('
+                'value INTEGER NOT NULL, started REAL NOT NULL)')
+            connection.execute(
+                'INSERT INTO epoch SELECT abs(random() % 4294967296), ? '
+                'WHERE NOT EXISTS (SELECT 1 FROM epoch)', (time.time(),))
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _connection(self):
+        """Return this process' and thread's connection to the database."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # A connection inherited from the parent of a forked process
+            # must not be used by the child
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def stamp(self, collection, key=None):
+        """Return the current generation of *collection* (or of the resource
+        with primary key *key* in it)."""
+        if key is None:
+            epoch, value = self._connection().execute(
+                'SELECT (SELECT value FROM epoch), '
+                '(SELECT value FROM generation '
+                "WHERE collection = ? AND key = '')",
+                (collection,)).fetchone()
+            return epoch, value or 0
+        epoch, all_value, value = self._connection().execute(
+            'SELECT (SELECT value FROM epoch), '
+            '(SELECT value FROM generation WHERE collection = ? AND key = ?), '
+            '(SELECT value FROM generation WHERE collection = ? AND key = ?)',
+            (collection, ALL_RESOURCES, collection, key)).fetchone()
+        return epoch, all_value or 0, value or 0
+
+    def last_modified(self, collection, key=None):
+        """Return the time (in seconds since the epoch) *collection* (or the
+        resource with primary key *key* in it) was last written."""
+        keys = [''] if key is None else [ALL_RESOURCES, key]
+        started, modified = self._connection().execute(
+            'SELECT (SELECT started FROM epoch), '
+            '(SELECT max(modified) FROM generation '
+            'WHERE collection = ? AND key IN ({}))'.format(
+                ', '.join('?' * len(keys))),
+            [collection] + keys).fetchone()
+        return started if modified is None else max(started, modified)
+
+    def bump(self, collection, key=None):
+        """Move on the generation of *collection* and, if *key* is given, of
+        the resource with that primary key."""
+        keys = [''] if key is None else ['', key]
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for generation_key in keys:
+                connection.execute(
+                    'INSERT OR IGNORE INTO generation VALUES (?, ?, 0, ?)',
+                    (collection, generation_key, now))
+                connection.execute(
+                    'UPDATE generation SET value = value + 1, modified = ? '
+                    'WHERE collection = ? AND key = ?',
+                    (now, collection, generation_key))
+            count, = connection.execute(
+                "SELECT COUNT(*) FROM generation WHERE key != ''").fetchone()
+            if count > self.max_size:
+                connection.execute("DELETE FROM generation WHERE key != ''")
+                connection.execute(
+                    'UPDATE epoch SET value = value + 1, started = ?', (now,))
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+
+class ResponseCache(object):
+    """Cache of finished responses to GET requests, invalidated by writes.
+
+    Each entry belongs to a collection and, if it represents a single
+    resource (or one of its attributes), to that resource's key. Rather than
+    tracking down every entry affected by a write, entries are stamped with
+    the *generation* of their collection (or resource) when they are
+    rendered; a write moves the generation on, and entries stamped with an
+    older one are treated as misses and eventually evicted.
+
+    *generations* defaults to :class:`Generations` private to this process;
+    pass :class:`SharedGenerations` to see writes made by other processes.
+    """
+
+    def __init__(self, max_size, generations=None):
+        self.entries = LRUCache(max_size)
+        self.generations = generations or Generations(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def stamp(self, collection, key=None):
+        """Return the current generation of *collection* (or of the resource
+        with primary key *key* in it).
+
+        Take the stamp *before* rendering a response, so that a write made
+        while it is being rendered invalidates it."""
+        return self.generations.stamp(collection, key)
+
+    def get(self, collection, key, variant):
+        """Return the response cached for *variant* (e.g. the request's
+        path, query string and content type) of *collection* or of the
+        resource *key* in it, or ``None`` if there is no current one."""
+        entry = self.entries.get((collection, key, variant))
+        if entry is not None:
+            stamp, response = entry
+            if stamp == self.stamp(collection, key):
+                self.hits += 1
+                return response
+        self.misses += 1
+        return None
+
+    def set(self, collection, key, variant, response, stamp, ttl=None):
+        """Cache *response*, rendered at generation *stamp*, for at most
+        *ttl* seconds if given."""
+        self.entries.set((collection, key, variant), (stamp, response), ttl)
+
+    def invalidate(self, collection, key=None):
+        """Invalidate the cached responses of *collection* and, if *key* is
+        given, of the resource with that primary key."""
+        self.generations.bump(collection, key)
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dictionary describing the cache's size and hit ratio.
+
+        :rtype: dict
+
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.entries.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
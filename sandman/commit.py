@@ -0,0 +1,130 @@
+"""Group commit: committing the writes of concurrent requests together."""
+
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class _Write(object):
+    """A write submitted to a :class:`GroupCommitter`, and its outcome."""
+
+    def __init__(self, action, resource):
+        self.action = action
+        self.resource = resource
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter(object):
+    """Commits the writes of concurrent requests together, in a background
+    thread, so that a burst of writes costs one commit rather than one each.
+
+    Writes are collected until *max_size* of them are waiting or *window*
+    seconds have passed since the first arrived. Each is then flushed in its
+    own ``SAVEPOINT``, so that one which fails is rolled back and reported to
+    the request which submitted it without affecting the others, and all of
+    them are committed in a single transaction.
+
+    *session* is the scoped session the committer thread uses. It shouldn't
+    expire resources on commit, since the requests render them afterwards;
+    values generated by the database other than primary keys (e.g. server
+    defaults) then aren't reloaded into them.
+    """
+
+    def __init__(self, session, window, max_size):
+        self.session = session
+        self.window = window
+        self.max_size = max_size
+        self.commits = 0
+        self._queue = queue.Queue()
+        thread = threading.Thread(target=self._run, name='sandman-committer')
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, action, resource):
+        """Perform the session *action* (``'add'``, ``'merge'`` or
+        ``'delete'``) on *resource* and wait until it has been committed.
+
+        *resource* must not belong to a session. Raises the exception which
+        caused the write (or its commit) to fail, if any.
+
+        """
+        write = _Write(action, resource)
+        self._queue.put(write)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+
+    def _run(self):
+        """Commit groups of writes as they arrive."""
+        while True:
+            writes = [self._queue.get()]
+            deadline = time.time() + self.window
+            while len(writes) < self.max_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    writes.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit(writes)
+
+    def _commit(self, writes):
+        """Flush each of *writes* in its own savepoint, then commit them.
+
+        Every write is given the error which made it fail, if any, so that
+        no request is told its write was committed when it wasn't.
+
+        """
+        session = self.session
+        dbapi_connection = isolation_level = None
+        try:
+            connection = session.connection()
+            if connection.dialect.name == 'sqlite':
+                # pysqlite's own transaction handling doesn't support
+                # SAVEPOINT, so begin the transaction explicitly
+                dbapi_connection = connection.connection.connection
+                isolation_level = dbapi_connection.isolation_level
+                dbapi_connection.isolation_level = None
+                connection.execute('BEGIN')
+            for write in writes:
+                savepoint = session.begin_nested()
+                try:
+                    session.add(write.resource)
+                    if write.action == 'delete':
+                        session.delete(write.resource)
+                    savepoint.commit()
+                except SQLAlchemyError as exception:
+                    savepoint.rollback()
+                    write.error = exception
+            if dbapi_connection is not None:
+                # Hand the connection back as it was; COMMIT still ends the
+                # transaction begun above
+                dbapi_connection.isolation_level = isolation_level
+                dbapi_connection = None
+            session.commit()
+            self.commits += 1
+        except Exception as exception:  # pylint: disable=broad-except
+            for write in writes:
+                if write.error is None:
+                    write.error = exception
+            try:
+                if dbapi_connection is not None:
+                    dbapi_connection.isolation_level = isolation_level
+                session.rollback()
+            except Exception:  # pylint: disable=broad-except
+                pass
+        finally:
+            try:
+                session.expunge_all()
+                session.remove()
+            finally:
+                for write in writes:
+                    write.done.set()
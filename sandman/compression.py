@@ -0,0 +1,117 @@
+"""Negotiated compression of response bodies.
+
+gzip is always available; brotli and zstd are used if the ``brotli`` and
+``zstandard`` packages are installed (``pip install sandman[brotli,zstd]``).
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content codings sandman can produce, most preferred first
+ENCODINGS = tuple(
+    encoding for encoding, available in (
+        ('zstd', zstandard is not None),
+        ('br', brotli is not None),
+        ('gzip', True)) if available)
+
+# The slowest (and smallest) level of each content coding, for bodies which
+# are compressed once and served many times
+MAX_LEVELS = {'zstd': 19, 'br': 11, 'gzip': 9}
+
+# Mimetypes worth compressing, besides every text/* type
+COMPRESSIBLE_TYPES = set([
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'application/vnd.ms-fontobject',
+    'application/x-font-ttf',
+    'image/svg+xml',
+    ])
+
+
+def is_compressible(mimetype):
+    """Return True if bodies of type *mimetype* are worth compressing.
+
+    :param string mimetype: mimetype of the response, without parameters
+    :rtype: bool
+
+    """
+    return bool(mimetype) and (
+        mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def negotiate_encoding(accept_encodings):
+    """Return the content coding to compress a response with, given the
+    client's ``Accept-Encoding``, or ``None`` if it accepts none of ours.
+
+    Codings the client gives equal quality are chosen in the order of
+    :data:`ENCODINGS`; ``q=0`` refuses a coding, even if ``*`` accepts it.
+
+    :param accept_encodings: the parsed ``Accept-Encoding`` header
+    :type accept_encodings: :class:`werkzeug.datastructures.Accept`
+    :rtype: string or None
+
+    """
+    qualities = dict(
+        (value.lower(), quality) for value, quality in accept_encodings)
+    best_encoding, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0))
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
+def compress(data, encoding, level=None):
+    """Return *data* compressed with the content coding *encoding*.
+
+    :param bytes data: the body to compress
+    :param string encoding: one of :data:`ENCODINGS`
+    :param int level: compression level (default: a fast one suited to
+        compressing responses as they are sent)
+    :rtype: bytes
+
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level).compress(data)
+    elif encoding == 'br':
+        return brotli.compress(data, quality=5 if level is None else level)
+    compressor = zlib.compressobj(
+        6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress the iterable of *chunks* with the content coding *encoding*,
+    yielding compressed data as it becomes available.
+
+    :param chunks: iterable of bytes
+    :param string encoding: one of :data:`ENCODINGS`
+    :rtype: generator
+
+    """
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
@@ -1,3 +1,5 @@
+import calendar
+import datetime
 import functools
 import hashlib
 from flask import jsonify, request, url_for, current_app, make_response, g
@@ -14,6 +16,38 @@ def cache_control(*directives):
     return decorator
 
 
+def cache_policy(get_directives):
+    """Add a ``Cache-Control`` header to the decorated GET view's ``200`` and
+    ``304`` responses, with the directives returned by *get_directives*
+    (called with the view's arguments). The header is omitted if there are
+    none."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            rv = make_response(f(*args, **kwargs))
+            if rv.status_code in (200, 304):
+                directives = get_directives(*args, **kwargs)
+                if directives:
+                    rv.headers['Cache-Control'] = ', '.join(directives)
+            return rv
+        return wrapped
+    return decorator
+
+
+def vary(*headers):
+    """Add the request *headers* the response depends on to its ``Vary``
+    header."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            rv = make_response(f(*args, **kwargs))
+            for header in headers:
+                rv.vary.add(header)
+            return rv
+        return wrapped
+    return decorator
+
+
 def no_cache(f):
     return cache_control('no-cache', 'no-store', 'max-age=0')(f)
 
@@ -26,25 +60,87 @@ def etag(f):
             '@etag is only supported for GET requests'
         rv = f(*args, **kwargs)
         rv = make_response(rv)
-        etag = '"' + hashlib.md5(rv.get_data()).hexdigest() + '"'
-        rv.headers['ETag'] = etag
+        if rv.is_streamed or rv.status_code == 304:
+            # hashing the body would consume the stream, and a 304 has
+            # already been checked against its ETag
+            return rv
+        etag = rv.headers.get('ETag')
+        if etag is None:
+            etag = '"' + hashlib.md5(rv.get_data()).hexdigest() + '"'
+            rv.headers['ETag'] = etag
         if_match = request.headers.get('If-Match')
         if_none_match = request.headers.get('If-None-Match')
         if if_match:
-            etag_list = [tag.strip() for tag in if_match.split(',')]
-            if etag not in etag_list and '*' not in etag_list:
+            if not etag_matches(etag, if_match, weak=False):
                 rv = precondition_failed()
         elif if_none_match:
-            etag_list = [tag.strip() for tag in if_none_match.split(',')]
-            if etag in etag_list or '*' in etag_list:
-                rv = not_modified()
+            if etag_matches(etag, if_none_match):
+                rv = not_modified(etag)
         return rv
     return wrapped
 
 
-def not_modified():
+def last_modified(get_last_modified):
+    """Add a ``Last-Modified`` header to the decorated GET view's responses,
+    and answer an ``If-Modified-Since`` no earlier than it with a 304 before
+    running the view.
+
+    *get_last_modified* is called with the view's arguments and returns a
+    :class:`datetime.datetime` (in UTC), a timestamp, or ``None`` if the
+    time isn't known.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            modified = get_last_modified(*args, **kwargs)
+            if modified is None:
+                return f(*args, **kwargs)
+            if isinstance(modified, datetime.datetime):
+                modified = calendar.timegm(modified.utctimetuple())
+            # HTTP dates have a resolution of one second
+            modified = int(modified)
+            if_modified_since = request.if_modified_since
+            # If-None-Match takes precedence over If-Modified-Since
+            if (if_modified_since is not None and
+                    'If-None-Match' not in request.headers and
+                    modified <= calendar.timegm(
+                        if_modified_since.utctimetuple())):
+                rv = not_modified()
+            else:
+                rv = make_response(f(*args, **kwargs))
+                if rv.status_code != 200:
+                    return rv
+            rv.last_modified = modified
+            return rv
+        return wrapped
+    return decorator
+
+
+def etag_matches(etag, header, weak=True):
+    """Return True if *etag* matches one of the ETags listed in *header*.
+
+    ``If-None-Match`` uses the weak comparison, which ignores the ``W/``
+    prefix; ``If-Match`` uses the strong one, which no weak ETag matches.
+    """
+    tags = [tag.strip() for tag in header.split(',')]
+    if '*' in tags:
+        return True
+    if not weak:
+        return not etag.startswith('W/') and etag in tags
+    return _opaque_tag(etag) in [_opaque_tag(tag) for tag in tags]
+
+
+def _opaque_tag(etag):
+    if etag.startswith('W/'):
+        return etag[2:]
+    return etag
+
+
+def not_modified(etag=None):
     response = jsonify({'status': 304, 'error': 'not modified'})
     response.status_code = 304
+    if etag is not None:
+        response.headers['ETag'] = etag
     return response
 
 
@@ -6,7 +6,7 @@ from decimal import Decimal
 from flask import current_app
 from flask.ext.admin.contrib.sqla import ModelView
 
-from sandman import app, db
+from sandman import db
 
 
 class Model(object):
@@ -42,6 +42,75 @@ class Model(object):
     Default: ``('GET', 'POST', 'PATCH', 'DELETE', 'PUT')``
     """
 
+    __total_count__ = None
+    """How the total number of resources in the (unfiltered) collection,
+    returned in the ``X-Total-Count`` header, is computed: ``'estimate'``
+    for the database planner's estimate (falling back to an exact count
+    where there is none), ``'exact'`` for a ``COUNT``, or ``None`` to omit
+    the header. Counts are cached for ``SANDMAN_COUNT_TTL`` seconds.
+
+    Default: None
+    """
+
+    __count_filtered__ = False
+    """Should filtered collections carry an exact ``X-Total-Count``? This
+    costs a ``COUNT`` query for each new set of filters.
+
+    Default: False
+    """
+
+    __cache_ttl__ = None
+    """The number of seconds responses for this :class:`sandman.model.Model`
+    are kept in the response cache (if ``SANDMAN_RESPONSE_CACHE_SIZE`` enables
+    it). 0 disables caching them.
+
+    Default: None (``SANDMAN_RESPONSE_CACHE_TTL``)
+    """
+
+    __version_column__ = None
+    """The name of a column (e.g. a row version or ``updated_at`` timestamp)
+    which changes whenever a row does. If set, the ETag of a resource is
+    derived from it, so that conditional GETs only need to select it.
+
+    Default: None
+    """
+
+    __last_modified_column__ = None
+    """The name of a timestamp column holding the time (in UTC) each row was
+    last updated. If set, the ``Last-Modified`` header of a resource is read
+    from it.
+
+    Default: None
+    """
+
+    __max_age__ = None
+    """The number of seconds browsers and other caches may consider responses
+    for this :class:`sandman.model.Model` fresh (``Cache-Control: max-age``).
+
+    Default: None
+    """
+
+    __s_maxage__ = None
+    """The number of seconds shared caches (e.g. CDNs) may consider responses
+    fresh, overriding :attr:`__max_age__` for them (``s-maxage``).
+
+    Default: None
+    """
+
+    __stale_while_revalidate__ = None
+    """The number of seconds a cache may keep serving a stale response while
+    it revalidates it (``stale-while-revalidate``).
+
+    Default: None
+    """
+
+    __cache_scope__ = None
+    """``'public'`` if responses may be stored by shared caches, or
+    ``'private'`` if only by the client's own cache.
+
+    Default: None
+    """
+
     __table__ = None
     """Will be populated by SQLAlchemy with the table's meta-information."""
 
@@ -88,6 +157,29 @@ class Model(object):
             cls = cls.__from_class__
         return cls.__table__.primary_key.columns.values()[0].name
 
+    @classmethod
+    def related_endpoints(cls):
+        """Return a list of ``(name, column, class)`` tuples, one for each
+        foreign key of the table whose referred table is registered.
+
+        *name* is the key under which the related resource is rendered,
+        *column* the name of the column holding the related resource's
+        primary key, and *class* the related :class:`sandman.model.Model`.
+
+        :rtype: list
+
+        """
+        related = []
+        class_references = current_app.class_references
+        for foreign_key in cls.__table__.foreign_keys:
+            table = foreign_key.column.table.name
+            if table not in class_references:
+                continue
+            endpoint = class_references[table]
+            related.append(
+                (endpoint.__name__.lower(), foreign_key.column.name, endpoint))
+        return related
+
     def links(self):
         """Return a list of links for endpoints related to the resource.
 
@@ -96,67 +188,106 @@ class Model(object):
         """
 
         links = []
-        for foreign_key in self.__table__.foreign_keys:
-            column = foreign_key.column.name
+        for _, column, endpoint in self.related_endpoints():
             column_value = getattr(self, column, None)
             if column_value:
-                table = foreign_key.column.table.name
-                with app.app_context():
-                    endpoint = current_app.class_references[table]
                 links.append({'rel': 'related', 'uri': '/{}/{}'.format(
                     endpoint.__name__, column_value)})
         links.append({'rel': 'self', 'uri': self.resource_uri()})
         return links
 
-    def as_dict(self, depth=0):
+    def as_dict(self, depth=0, expand=None, fields=None):
         """Return a dictionary containing only the attributes which map to
         an instance's database columns.
 
         :param int depth: Maximum depth to recurse subobjects
+        :param dict expand: tree of the names of the related resources to
+            expand (e.g. ``{'album': {'artist': {}}}``); overrides *depth*
+        :param list fields: names of the only columns to include (default:
+            all)
         :rtype: dict
 
         """
         result_dict = {}
         for column in self.__table__.columns.keys():
+            if fields is not None and column not in fields:
+                continue
             result_dict[column] = getattr(self, column, None)
             if isinstance(result_dict[column], Decimal):
                 result_dict[column] = str(result_dict[column])
         result_dict['links'] = self.links()
-        for foreign_key in self.__table__.foreign_keys:
-            column_name = foreign_key.column.name
+        for name, column_name, endpoint in self.related_endpoints():
             column_value = getattr(self, column_name, None)
             if column_value:
-                table = foreign_key.column.table.name
-                with app.app_context():
-                    endpoint = current_app.class_references[table]
-                    session = db.session()
-                    resource = session.query(endpoint).get(column_value)
-                if depth > 0:
+                expansion = _expansion(name, depth, expand)
+                if expansion is not None:
+                    # Served from the session's identity map if the related
+                    # resource was loaded by load_related
+                    resource = db.session().query(endpoint).get(column_value)
                     result_dict.update({
                         'rel': endpoint.__name__,
-                        endpoint.__name__.lower(): resource.as_dict(depth - 1)
+                        name: resource.as_dict(*expansion)
                         })
                 else:
-                    result_dict[
-                        endpoint.__name__.lower() + '_url'] = '/{}/{}'.format(
+                    result_dict[name + '_url'] = '/{}/{}'.format(
                         endpoint.__name__, column_value)
 
         result_dict['self'] = self.resource_uri()
         return result_dict
 
+    @classmethod
+    def load_related(cls, resources, depth=1, expand=None):
+        """Load the resources referred to by the foreign keys of *resources*
+        into the session, issuing a single ``IN (...)`` query per foreign key
+        (and per level of expansion) rather than one query per resource.
+
+        Subsequent calls to :meth:`as_dict` with the same *depth* and
+        *expand* then find the related resources in the session's identity
+        map. The returned list must be kept alive until rendering is done,
+        since the identity map only holds weak references.
+
+        :param list resources: instances of *cls*
+        :param int depth: number of levels of related resources to load
+        :param dict expand: tree of the names of the related resources to
+            load; overrides *depth*
+        :rtype: list
+
+        """
+        loaded = []
+        if not resources:
+            return loaded
+        session = db.session()
+        for name, column_name, endpoint in cls.related_endpoints():
+            expansion = _expansion(name, depth, expand)
+            if expansion is None:
+                continue
+            values = set(
+                getattr(resource, column_name, None) for resource in resources)
+            values.discard(None)
+            if not values:
+                continue
+            related = session.query(endpoint).filter(
+                getattr(endpoint, endpoint.primary_key()).in_(values)).all()
+            loaded.extend(related)
+            loaded.extend(endpoint.load_related(related, *expansion))
+        return loaded
+
     def from_dict(self, dictionary):
         """Set a set of attributes which correspond to the
         :class:`sandman.model.Model`'s columns.
 
+        Only the columns present in *dictionary* are set (to ``None`` if
+        their value is ``null``), so that flushing the instance only updates
+        those which changed.
+
         :param dict dictionary: A dictionary of attributes to set on the
             instance whose keys are the column names of
             the :class:`sandman.model.Model`'s underlying database table.
 
         """
         for column in self.__table__.columns.keys():
-            value = dictionary.get(column, None)
-            if value:
-                setattr(self, column, value)
+            if column in dictionary:
+                setattr(self, column, dictionary[column])
 
     def replace(self, dictionary):
         """Set all attributes which correspond to the
@@ -169,8 +300,7 @@ class Model(object):
 
         """
         for column in self.__table__.columns.keys():
-            setattr(self, column, None)
-        self.from_dict(dictionary)
+            setattr(self, column, dictionary.get(column))
 
     @classmethod
     def meta(cls):
@@ -188,6 +318,26 @@ class Model(object):
         return str(getattr(self, self.primary_key()))
 
 
+def _expansion(name, depth, expand):
+    """Return the ``(depth, expand)`` arguments with which the related
+    resource *name* should itself be rendered, or ``None`` if it should not
+    be expanded.
+
+    :param string name: name of the related resource
+    :param int depth: remaining depth to expand all related resources to
+    :param dict expand: tree of the names of related resources to expand
+    :rtype: tuple or None
+
+    """
+    if expand is not None:
+        if name not in expand:
+            return None
+        return 0, expand[name]
+    if depth > 0:
+        return depth - 1, None
+    return None
+
+
 class AdminModelViewWithPK(ModelView):
     """Mixin admin view class that displays primary keys on the admin form"""
     column_display_pk = True
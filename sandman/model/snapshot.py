@@ -0,0 +1,122 @@
+"""Snapshots of a database's reflected schema, which spare large databases
+from being reflected on every start-up."""
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+import sqlalchemy
+from sqlalchemy.engine import reflection
+from sqlalchemy.schema import MetaData
+
+
+def schema_fingerprint(engine):
+    """Return a fingerprint of the schema of the database *engine* connects
+    to, cheap enough to compute on every start-up.
+
+    It covers the database's URL and the names of its tables (along with the
+    versions of SQLAlchemy and Python which pickle them), but not their
+    columns: a snapshot must be refreshed explicitly after a table is
+    altered.
+
+    :param engine: engine connected to the database
+    :rtype: string
+
+    """
+    table_names = reflection.Inspector.from_engine(engine).get_table_names()
+    digest = hashlib.sha1()
+    for part in [sqlalchemy.__version__, sys.version_info[0],
+                 repr(engine.url)] + sorted(table_names):
+        digest.update(u'{}\0'.format(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ReflectionSnapshot(object):
+    """The reflected tables of a database and their foreign keys, saved to a
+    local file so that later start-ups can load them instead of reflecting
+    the database again.
+
+    Snapshots are pickled, so their file must be as trusted as the code.
+    """
+
+    def __init__(self, fingerprint, metadata, foreign_keys):
+        self.fingerprint = fingerprint
+        self.metadata = metadata
+        self.foreign_keys = foreign_keys
+
+    @classmethod
+    def take(cls, engine):
+        """Reflect every table of the database *engine* connects to, and the
+        foreign keys of each.
+
+        :param engine: engine connected to the database
+        :rtype: :class:`ReflectionSnapshot`
+
+        """
+        fingerprint = schema_fingerprint(engine)
+        metadata = MetaData()
+        metadata.reflect(bind=engine)
+        inspector = reflection.Inspector.from_engine(engine)
+        foreign_keys = dict(
+            (name, inspector.get_foreign_keys(name))
+            for name in metadata.tables)
+        return cls(fingerprint, metadata, foreign_keys)
+
+    @classmethod
+    def load(cls, path, engine):
+        """Return the snapshot saved at *path*, or ``None`` if there is none
+        or it was taken of a different schema than that of the database
+        *engine* connects to.
+
+        :param string path: location of the snapshot
+        :param engine: engine connected to the database
+        :rtype: :class:`ReflectionSnapshot` or None
+
+        """
+        try:
+            with open(path, 'rb') as snapshot_file:
+                state = pickle.load(snapshot_file)
+        # A missing, corrupt or incompatible snapshot is simply taken again
+        except Exception:  # pylint: disable=broad-except
+            return None
+        if (not isinstance(state, dict) or
+                state.get('fingerprint') != schema_fingerprint(engine)):
+            return None
+        return cls(state['fingerprint'], state['metadata'],
+                   state['foreign_keys'])
+
+    def save(self, path):
+        """Write the snapshot to *path*, replacing any earlier one at once.
+
+        :param string path: location of the snapshot
+
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as snapshot_file:
+                pickle.dump({
+                    'fingerprint': self.fingerprint,
+                    'metadata': self.metadata,
+                    'foreign_keys': self.foreign_keys,
+                    }, snapshot_file, 2)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(temporary_path, path)
+        except Exception:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def restore(self, metadata):
+        """Add the snapshot's tables to *metadata*, as if it had reflected
+        them. Tables *metadata* already has are left alone.
+
+        :param `sqlalchemy.schema.MetaData` metadata: metadata to add to
+
+        """
+        for key, table in self.metadata.tables.items():
+            if key not in metadata.tables:
+                table.tometadata(metadata)
@@ -1,17 +1,37 @@
 """Various utility functions for registering and activating models."""
 import webbrowser
 import collections
+import contextlib
+import threading
 
-from flask import current_app, g
+from flask import current_app, g, has_app_context
 from flask.ext.admin import Admin
 from flask.ext.admin.contrib.sqla import ModelView
+from sqlalchemy import and_, bindparam, text
 from sqlalchemy.engine import reflection
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base, DeferredReflection
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Table
 
 from sandman import app, db
 from sandman.model.models import Model, AdminModelViewWithPK
+from sandman.model.snapshot import ReflectionSnapshot
+
+# Held while a table is reflected on its endpoint's first request
+_reflection_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _app_context():
+    """Run the enclosed block in the current application context, or in a new
+    one if there is none. Popping a context of its own during a request would
+    remove the request's session."""
+    if has_app_context():
+        yield
+    else:
+        with app.app_context():
+            yield
 
 
 def _get_session():
@@ -22,15 +42,158 @@ def _get_session():
     return session
 
 
-def generate_endpoint_classes(db, generate_pks=False):
+def estimate_row_count(engine, table):
+    """Return the database's own estimate of the number of rows in *table*,
+    without scanning it, or ``None`` if no estimate is available.
+
+    Estimates come from ``pg_class.reltuples`` on PostgreSQL and
+    ``sqlite_stat1`` on SQLite, and are only as fresh as the last
+    ``ANALYZE``. Other databases have no estimate.
+
+    :param engine: engine connected to the database
+    :param `sqlalchemy.schema.Table` table: table to estimate the size of
+
+    """
+    if engine.dialect.name == 'postgresql':
+        name = '"{}"'.format(table.name)
+        if table.schema is not None:
+            name = '"{}".{}'.format(table.schema, name)
+        statement = text(
+            'SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)')
+    elif engine.dialect.name == 'sqlite':
+        name = table.name
+        statement = text(
+            'SELECT stat FROM sqlite_stat1 WHERE tbl = :name LIMIT 1')
+    else:
+        return None
+    # Use a connection of its own, since a failed query aborts the current
+    # transaction on some databases
+    try:
+        with engine.connect() as connection:
+            estimate = connection.execute(statement, name=name).scalar()
+    except SQLAlchemyError:
+        return None
+    if estimate is None:
+        return None
+    # sqlite_stat1's "stat" column starts with the number of rows
+    estimate = int(float(str(estimate).split()[0]))
+    if estimate < 0:
+        return None
+    return estimate
+
+
+def upsert(session, table, key_name, key, values):
+    """Insert a row with the primary key *key* and the column *values* into
+    *table*, or update the row which already has that key, in as few
+    statements as the database allows, and return ``True`` if the row was
+    inserted.
+
+    On PostgreSQL this is a single ``INSERT ... ON CONFLICT DO UPDATE``, which
+    reports whether it inserted. Elsewhere the row is updated, and inserted
+    only if there was none to update: with ``ON DUPLICATE KEY UPDATE`` on
+    MySQL and ``ON CONFLICT DO UPDATE`` on SQLite 3.24 and later, so that a
+    row inserted concurrently in between is updated rather than raising an
+    error, and with a plain ``INSERT`` on other databases.
+
+    :param session: session to execute the statements in
+    :param `sqlalchemy.schema.Table` table: table to write to
+    :param string key_name: name of *table*'s primary key column
+    :param key: primary key of the row
+    :param dict values: values of the other columns, by name
+    :rtype: bool
+
+    """
+    connection = session.connection()
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    names = [key_name] + sorted(values)
+    parameters = [
+        bindparam('p{}'.format(index), values.get(name, key),
+                  type_=table.columns[name].type)
+        for index, name in enumerate(names)]
+    columns = ', '.join(preparer.quote(name) for name in names)
+    placeholders = ', '.join(
+        ':p{}'.format(index) for index in range(len(names)))
+    insert = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        preparer.format_table(table), columns, placeholders)
+    key_column = preparer.quote(key_name)
+    excluded = ', '.join('{0} = EXCLUDED.{0}'.format(preparer.quote(name))
+                         for name in names[1:])
+
+    if dialect.name == 'postgresql':
+        if excluded:
+            insert += ' ON CONFLICT ({}) DO UPDATE SET {} RETURNING (xmax = 0)'
+        else:
+            insert += ' ON CONFLICT ({}) DO NOTHING RETURNING TRUE'
+        row = session.execute(text(insert.format(key_column, excluded),
+                                   bindparams=parameters)).first()
+        return row is not None and bool(row[0])
+
+    if len(names) > 1:
+        assignments = ', '.join('{} = :p{}'.format(preparer.quote(name), index)
+                                for index, name in enumerate(names) if index)
+        update = 'UPDATE {} SET {} WHERE {} = :p0'.format(
+            preparer.format_table(table), assignments, key_column)
+        if session.execute(
+                text(update, bindparams=parameters)).rowcount > 0:
+            return False
+    else:
+        select = 'SELECT 1 FROM {} WHERE {} = :p0'.format(
+            preparer.format_table(table), key_column)
+        if session.execute(
+                text(select, bindparams=parameters[:1])).first() is not None:
+            return False
+
+    if dialect.name == 'mysql':
+        insert += ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            '{0} = VALUES({0})'.format(preparer.quote(name))
+            for name in names[1:] or names)
+        # One affected row for an insert, two for an update
+        return session.execute(
+            text(insert, bindparams=parameters)).rowcount == 1
+    elif dialect.name == 'sqlite' and getattr(
+            dialect.dbapi, 'sqlite_version_info', ()) >= (3, 24):
+        if excluded:
+            insert += ' ON CONFLICT ({}) DO UPDATE SET {}'
+        else:
+            insert += ' ON CONFLICT ({}) DO NOTHING'
+        insert = insert.format(key_column, excluded)
+    # SQLite reports a row changed either way, but the UPDATE above already
+    # holds the database's write lock, so no other insert can come between
+    session.execute(text(insert, bindparams=parameters))
+    return True
+
+
+def generate_endpoint_classes(db, generate_pks=False, snapshot=None,
+                              only=None):
     """Return a list of model classes generated for each reflected database
-    table."""
+    table.
+
+    If a :class:`sandman.model.snapshot.ReflectionSnapshot` *snapshot* is
+    given, its tables are used instead of reflecting the database. If the
+    list of table names *only* is given, only those tables (and the tables
+    they refer to) are reflected and given classes."""
+    classes = []
     seen_classes = set()
     for cls in current_app.class_references.values():
         seen_classes.add(cls.__tablename__)
-    with app.app_context():
-        db.metadata.reflect(bind=db.engine)
-        for name, table in db.metadata.tables.items():
+    with _app_context():
+        if snapshot is None:
+            db.metadata.reflect(bind=db.engine, only=only)
+        else:
+            snapshot.restore(db.metadata)
+        tables = db.metadata.tables
+        if only is not None:
+            names = set()
+            pending = list(only)
+            while pending:
+                name = pending.pop()
+                if name not in names:
+                    names.add(name)
+                    pending.extend(foreign_key.column.table.name for
+                                   foreign_key in tables[name].foreign_keys)
+            tables = dict((name, tables[name]) for name in names)
+        for name, table in tables.items():
             if not name in seen_classes:
                 seen_classes.add(name)
                 if not table.primary_key and generate_pks:
@@ -41,6 +204,8 @@ def generate_endpoint_classes(db, generate_pks=False):
                         (sandman_model, db.Model),
                         {'__tablename__': name})
                 register(cls)
+                classes.append(cls)
+    return classes
 
 
 def add_pk_if_required(db, table, name):
@@ -51,7 +216,6 @@ def add_pk_if_required(db, table, name):
     :param  table: table to create primary key for
 
     """
-    db.metadata.reflect(bind=db.engine)
     cls_dict = {'__tablename__': name}
     if not table.primary_key:
         for column in table.columns:
@@ -63,14 +227,26 @@ def add_pk_if_required(db, table, name):
     return type(str(name), (sandman_model, db.Model), cls_dict)
 
 
-def prepare_relationships(db, known_tables):
+def prepare_relationships(db, known_tables, foreign_keys=None, classes=None):
     """Enrich the registered Models with SQLAlchemy ``relationships``
     so that related tables are correctly processed up by the admin.
 
+    :param dict foreign_keys: the foreign keys of each table, by name, as
+        returned by the inspector's ``get_foreign_keys`` (default: ask the
+        inspector)
+    :param classes: the Models to add the relationships of their foreign keys
+        to (default: every Model in *known_tables*)
+
     """
     inspector = reflection.Inspector.from_engine(db.engine)
-    for cls in set(known_tables.values()):
-        for foreign_key in inspector.get_foreign_keys(cls.__tablename__):
+    if classes is None:
+        classes = known_tables.values()
+    for cls in set(classes):
+        if foreign_keys is not None and cls.__tablename__ in foreign_keys:
+            table_foreign_keys = foreign_keys[cls.__tablename__]
+        else:
+            table_foreign_keys = inspector.get_foreign_keys(cls.__tablename__)
+        for foreign_key in table_foreign_keys:
             if foreign_key['referred_table'] in known_tables:
                 other = known_tables[foreign_key['referred_table']]
                 constrained_column = foreign_key['constrained_columns']
@@ -79,11 +255,20 @@ def prepare_relationships(db, known_tables):
                     cls.__related_tables__.add(other)
                     # Add a SQLAlchemy relationship as an attribute
                     # on the class
+                    # on the class. Classes generated lazily don't share a
+                    # registry or metadata with the registered ones, so the
+                    # relationship is given by the columns themselves
+                    columns = [cls.__table__.columns[column]
+                               for column in constrained_column]
                     setattr(cls, other.__table__.name, relationship(
-                            other.__name__, backref=db.backref(
+                            other, backref=db.backref(
                                 cls.__name__.lower()),
-                            foreign_keys=str(cls.__name__) + '.' +
-                            ''.join(constrained_column)))
+                            primaryjoin=and_(*[
+                                column == other.__table__.columns[referred]
+                                for column, referred in zip(
+                                    columns,
+                                    foreign_key['referred_columns'])]),
+                            foreign_keys=columns))
 
 
 def register(cls, use_admin=True):
@@ -95,7 +280,7 @@ def register(cls, use_admin=True):
     :type cls: :class:`sandman.model.Model` or tuple
 
     """
-    with app.app_context():
+    with _app_context():
         if getattr(current_app, 'class_references', None) is None:
             current_app.class_references = {}
         if isinstance(cls, (list, tuple)):
@@ -113,7 +298,7 @@ def register_internal_data(cls):
     :params `sandman.model.Model` cls: class to register
 
     """
-    with app.app_context():
+    with _app_context():
         if getattr(cls, 'endpoint', None) is None:
             orig_class = cls
             cls = type('Sandman' + cls.__name__, (cls, Model), {})
@@ -160,7 +345,108 @@ def register_classes_for_admin(db_session, show_pks=True, name='admin'):
             admin_view.add_view(admin_view_class(cls, db_session))
 
 
-def activate(admin=True, browser=True, name='admin', reflect_all=False):
+def _prepare_lazy_reflection(db):
+    """Record the name of each of the database's tables, under each name its
+    endpoint can be requested by, for :func:`reflect_endpoint_class`.
+
+    Tables which already have a registered class are left out, since their
+    endpoints are served by that class. A table is only forgotten once it
+    has been requested itself, even if it was reflected before as one which
+    refers to another."""
+    registered = set(
+        cls.__tablename__ for cls in
+        (getattr(app, 'class_references', None) or {}).values())
+    lazy_tables = {}
+    for name in reflection.Inspector.from_engine(db.engine).get_table_names():
+        if name in registered:
+            continue
+        # The endpoint of a generated class, as in Model.endpoint
+        endpoint = name.lower()
+        if not endpoint.endswith('s'):
+            endpoint += 's'
+        lazy_tables[name] = lazy_tables[endpoint] = name
+    app.lazy_tables = lazy_tables
+    app.lazy_referrers = None
+
+
+def _get_lazy_referrers(db):
+    """Return (and memoize) the names of the tables which refer to each of the
+    database's tables, by name."""
+    referrers = getattr(app, 'lazy_referrers', None)
+    if referrers is None:
+        inspector = reflection.Inspector.from_engine(db.engine)
+        referrers = {}
+        for name in inspector.get_table_names():
+            for foreign_key in inspector.get_foreign_keys(name):
+                if foreign_key['referred_table'] != name:
+                    referrers.setdefault(
+                        foreign_key['referred_table'], []).append(name)
+        app.lazy_referrers = referrers
+    return referrers
+
+
+def reflect_endpoint_class(db, collection):
+    """Reflect the table behind the endpoint *collection*, if :func:`activate`
+    was called with *lazy* and it hasn't been requested yet, and return the
+    class generated for it, or ``None`` if there is no such table.
+
+    Classes are also generated for the tables it refers to and the tables
+    which refer to it, which are reflected along with it, and given their
+    relationships, so that deleting a resource which is still referred to
+    fails as it would had every table been reflected up front. Only one
+    request reflects tables at a time.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :rtype: :class:`sandman.model.Model` or None
+
+    """
+    lazy_tables = getattr(app, 'lazy_tables', None)
+    if not lazy_tables or collection not in lazy_tables:
+        return None
+    with _reflection_lock:
+        name = lazy_tables.get(collection)
+        if name is not None:
+            class_references = current_app.class_references
+            tables = [name] + _get_lazy_referrers(db).get(name, [])
+            classes = generate_endpoint_classes(
+                db, app.config.get('SANDMAN_GENERATE_PKS', None) or False,
+                only=tables)
+            classes.extend(class_references[table] for table in tables
+                           if table in class_references)
+            prepare_relationships(db, class_references, classes=classes)
+            for key in [key for key, table in lazy_tables.items()
+                        if table == name]:
+                del lazy_tables[key]
+        return current_app.class_references.get(collection)
+
+
+def _get_snapshot(db):
+    """Return the reflection snapshot configured by the
+    ``SANDMAN_REFLECTION_SNAPSHOT`` config value, taking (and saving) it if
+    it is missing or out of date, or ``None`` if none is configured."""
+    path = app.config.get('SANDMAN_REFLECTION_SNAPSHOT')
+    if not path:
+        return None
+    snapshot = ReflectionSnapshot.load(path, db.engine)
+    if snapshot is None:
+        snapshot = refresh_snapshot(db, path)
+    return snapshot
+
+
+def refresh_snapshot(db, path):
+    """Reflect the database again and save the snapshot of it to *path*.
+
+    :param string path: location of the snapshot
+    :rtype: :class:`sandman.model.snapshot.ReflectionSnapshot`
+
+    """
+    snapshot = ReflectionSnapshot.take(db.engine)
+    snapshot.save(path)
+    return snapshot
+
+
+def activate(admin=True, browser=True, name='admin', reflect_all=False,
+             lazy=False):
     """Activate each pre-registered model or generate the model classes and
     (possibly) register them for the admin.
 
@@ -170,16 +456,31 @@ def activate(admin=True, browser=True, name='admin', reflect_all=False):
                  this to avoid naming conflicts with other blueprints (if
                  trying to use sandman to connect to multiple databases
                  simultaneously)
+    :param bool lazy: when generating classes for every table, only fetch
+                      the tables' names now, and reflect each table the first
+                      time its endpoint is requested. The admin interface
+                      only covers the classes which were registered up front.
+
+    If the ``SANDMAN_REFLECTION_SNAPSHOT`` config value names a file, the
+    reflected schema is loaded from the snapshot there, if it was taken of
+    the same schema, and saved to it otherwise (see
+    :class:`sandman.model.snapshot.ReflectionSnapshot`).
 
     """
     with app.app_context():
         generate_pks = app.config.get('SANDMAN_GENERATE_PKS', None) or False
+        snapshot = None if lazy else _get_snapshot(db)
         if getattr(app, 'class_references', None) is None or reflect_all:
             app.class_references = collections.OrderedDict()
-            generate_endpoint_classes(db, generate_pks)
+            if lazy:
+                _prepare_lazy_reflection(db)
+            else:
+                generate_endpoint_classes(db, generate_pks, snapshot)
         else:
             Model.prepare(db.engine)
-        prepare_relationships(db, current_app.class_references)
+        prepare_relationships(
+            db, current_app.class_references,
+            snapshot.foreign_keys if snapshot is not None else None)
         if admin:
             try:
                 show_pks = current_app.config['SANDMAN_SHOW_PKS']
@@ -1,22 +1,72 @@
 """Sandman REST API creator for Flask and SQLAlchemy"""
 
+import base64
+import collections
+import csv
+import datetime
+import functools
+import hashlib
+import json
+import os
+import re
+from decimal import Decimal
+
 from flask import (
+    g,
+    has_app_context,
     jsonify,
     request,
     current_app,
     Response,
     render_template,
-    make_response)
+    make_response,
+    safe_join,
+    stream_with_context)
+from sqlalchemy import and_, or_, bindparam, event, func, inspect
+from sqlalchemy.types import String
 from sqlalchemy.exc import IntegrityError
-from . import app
-from .decorators import etag, no_cache
+from sqlalchemy.orm import load_only, mapper
+from sqlalchemy.orm.util import identity_key
+from werkzeug.routing import BaseConverter
+from werkzeug.urls import url_encode
+from . import app, db
+from .cache import (
+    ALL_RESOURCES,
+    Generations,
+    LRUCache,
+    QueryCache,
+    ResponseCache,
+    SharedGenerations)
+from .commit import GroupCommitter
+from .compression import (
+    MAX_LEVELS,
+    compress,
+    compress_stream,
+    is_compressible,
+    negotiate_encoding)
+from .decorators import (
+    cache_policy,
+    etag,
+    etag_matches,
+    last_modified,
+    no_cache,
+    not_modified,
+    vary)
 from .exception import InvalidAPIUsage
 from .model.models import Model
-from .model.utils import _get_session
+from .model.utils import (
+    _get_session,
+    estimate_row_count,
+    reflect_endpoint_class,
+    upsert)
 
-JSON, HTML = range(2)
+JSON, HTML, NDJSON, CSV = range(4)
 JSON_CONTENT_TYPES = set(['application/json'])
 HTML_CONTENT_TYPES = set(['text/html', 'application/x-www-form-urlencoded'])
+NDJSON_CONTENT_TYPES = set(['application/x-ndjson'])
+MERGE_PATCH_CONTENT_TYPES = set(['application/merge-patch+json'])
+JSON_PATCH_CONTENT_TYPES = set(['application/json-patch+json'])
+CSV_CONTENT_TYPES = set(['text/csv'])
 ALL_CONTENT_TYPES = set(['*/*'])
 ACCEPTABLE_CONTENT_TYPES = (
     JSON_CONTENT_TYPES |
@@ -27,6 +77,152 @@ FORWARDED_EXCEPTION_MESSAGE = 'Request could not be completed. Exception: [{}]'
 FORBIDDEN_EXCEPTION_MESSAGE = """Method [{}] not acceptable for resource \
 type [{}].  Acceptable methods: [{}]"""
 UNSUPPORTED_CONTENT_TYPE_MESSAGE = 'Content-type [{types}] not supported.'
+INVALID_CURSOR_MESSAGE = 'Invalid cursor [{}]'
+INVALID_EXPAND_MESSAGE = 'No related resource [{}] for resource type [{}]'
+INVALID_FIELD_MESSAGE = 'No field [{}] for resource type [{}]'
+INVALID_VALUE_MESSAGE = 'Invalid value [{}] for field [{}]'
+INVALID_OPERATOR_MESSAGE = 'Invalid operator [{}] for field [{}]'
+INVALID_ITEM_MESSAGE = 'Item [{}] is not an object'
+INVALID_LINE_MESSAGE = 'Line [{}] is not valid JSON'
+INVALID_BATCH_MESSAGE = 'Invalid batch request [{}]'
+INVALID_PATCH_MESSAGE = 'Invalid JSON Patch operation [{}]'
+FAILED_TEST_MESSAGE = 'JSON Patch test failed for [{}]'
+MISSING_FILTER_MESSAGE = """Method [{}] on the collection [{}] requires at \
+least one filter"""
+
+# Query arguments of a collection request which are not column filters
+COLLECTION_ARGUMENTS = set(
+    ['page', 'after', 'expand', 'fields', 'sort', 'limit'])
+# Filter operators, appended to a column name with a double underscore
+# (e.g. "Milliseconds__gt=300000")
+FILTER_OPERATORS = set(
+    ['gt', 'gte', 'lt', 'lte', 'in', 'between', 'isnull', 'startswith'])
+DATETIME_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d')
+
+def _get_query_cache():
+    """Return (and memoize) the cache of collection query statements, sized
+    by the ``SANDMAN_QUERY_CACHE_SIZE`` config value (0 disables it)."""
+    query_cache = getattr(app, 'query_cache', None)
+    if query_cache is None:
+        query_cache = app.query_cache = QueryCache(
+            app.config.get('SANDMAN_QUERY_CACHE_SIZE', 256))
+    return query_cache
+
+
+def _get_count_cache():
+    """Return (and memoize) the cache of collection counts, holding at most
+    ``SANDMAN_COUNT_CACHE_SIZE`` counts."""
+    count_cache = getattr(app, 'count_cache', None)
+    if count_cache is None:
+        count_cache = app.count_cache = LRUCache(
+            app.config.get('SANDMAN_COUNT_CACHE_SIZE', 1024))
+    return count_cache
+
+
+def _get_generations():
+    """Return (and memoize) the write generations of each collection and
+    resource, from which cached responses and ETags are validated.
+
+    If ``SANDMAN_CACHE_GENERATION_FILE`` names a file, the generations are
+    kept in it, so that writes handled by any process sharing the file are
+    seen by this one."""
+    generations = getattr(app, 'generations', None)
+    if generations is None:
+        max_size = app.config.get('SANDMAN_MAX_GENERATIONS', 10000)
+        path = app.config.get('SANDMAN_CACHE_GENERATION_FILE')
+        if path:
+            generations = SharedGenerations(path, max_size)
+        else:
+            generations = Generations(max_size)
+        app.generations = generations
+    return generations
+
+
+def _get_response_cache():
+    """Return (and memoize) the cache of GET responses, or ``None`` unless the
+    ``SANDMAN_RESPONSE_CACHE_SIZE`` config value enables it."""
+    response_cache = getattr(app, 'response_cache', None)
+    if response_cache is None:
+        max_size = app.config.get('SANDMAN_RESPONSE_CACHE_SIZE', 0)
+        if max_size:
+            response_cache = app.response_cache = ResponseCache(
+                max_size, _get_generations())
+    return response_cache
+
+
+def _bump_generations(resource):
+    """Move on the write generations of *resource* and its collection,
+    invalidating the cached responses and ETags derived from them.
+
+    :param resource: a resource which has just been written
+    :type resource: :class:`sandman.model.Model`
+
+    """
+    # The identity the resource was loaded (or inserted) with, which doesn't
+    # require reloading it after the commit
+    identity = inspect(resource).identity
+    key = None if identity is None else str(identity[0])
+    _bump_generation(type(resource).endpoint(), key)
+
+
+def _bump_generation(collection, key=None):
+    """Move on the write generation of *collection* (and of the resource
+    *key* in it), or, while the writes of a batch are held in a single
+    transaction, once it has been committed.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :param string key: the primary key of the resource written
+
+    """
+    batch_writes = getattr(g, 'batch_writes', None)
+    if batch_writes is not None:
+        batch_writes.append((collection, key))
+    else:
+        _get_generations().bump(collection, key)
+
+
+def _commit(session):
+    """Commit *session*, or, while the writes of a batch are held in a
+    single transaction, just flush it.
+
+    :param session: the current request's session
+
+    """
+    if getattr(g, 'batch_writes', None) is not None:
+        session.flush()
+    else:
+        session.commit()
+
+
+def _get_static_compression_cache():
+    """Return (and memoize) the cache of compressed static files."""
+    static_compression_cache = getattr(app, 'static_compression_cache', None)
+    if static_compression_cache is None:
+        static_compression_cache = app.static_compression_cache = LRUCache(
+            app.config.get('SANDMAN_STATIC_COMPRESSION_CACHE_SIZE', 128))
+    return static_compression_cache
+
+
+def _get_group_committer():
+    """Return (and memoize) the committer of groups of concurrent writes, or
+    ``None`` unless the ``SANDMAN_GROUP_COMMIT`` config value enables it.
+
+    Writes are grouped for up to ``SANDMAN_GROUP_COMMIT_WINDOW`` seconds
+    (0.002 by default) or until ``SANDMAN_GROUP_COMMIT_SIZE`` (100 by
+    default) are waiting."""
+    group_committer = getattr(app, 'group_committer', None)
+    if group_committer is None and app.config.get('SANDMAN_GROUP_COMMIT'):
+        group_committer = app.group_committer = GroupCommitter(
+            db.create_scoped_session({'expire_on_commit': False}),
+            app.config.get('SANDMAN_GROUP_COMMIT_WINDOW', 0.002),
+            app.config.get('SANDMAN_GROUP_COMMIT_SIZE', 100))
+    return group_committer
+
 
 def _perform_database_action(action, *args):
     """Call session.*action* with the given *args*.
@@ -34,8 +230,17 @@ def _perform_database_action(action, *args):
     Will later be used to abstract away database backend.
     """
     session = _get_session()
-    getattr(session, action)(*args)
-    session.commit()
+    group_committer = _get_group_committer()
+    if group_committer is not None and getattr(
+            g, 'batch_writes', None) is None:
+        resource = args[0]
+        if resource in session:
+            session.expunge(resource)
+        group_committer.submit(action, resource)
+    else:
+        getattr(session, action)(*args)
+        _commit(session)
+    _bump_generations(args[0])
 
 
 def _get_acceptable_response_type():
@@ -54,6 +259,23 @@ def _get_acceptable_response_type():
         raise InvalidAPIUsage(406)
 
 
+def _get_collection_response_type():
+    """Return the mimetype for a request for a collection.
+
+    In addition to the types supported for every request, collections can be
+    returned as newline-delimited JSON or CSV.
+    """
+    if 'Accept' in request.headers:
+        acceptable_content_types = set(
+            content_type.split(';')[0].strip() for content_type in
+            request.headers['Accept'].split(','))
+        if acceptable_content_types & NDJSON_CONTENT_TYPES:
+            return NDJSON
+        elif acceptable_content_types & CSV_CONTENT_TYPES:
+            return CSV
+    return _get_acceptable_response_type()
+
+
 @app.errorhandler(InvalidAPIUsage)
 def handle_exception(error):
     """Return a response with the appropriate status code, message, and content
@@ -85,16 +307,20 @@ def _single_attribute_json_response(name, value):
     return jsonify({name: str(value)})
 
 
-def _single_resource_json_response(resource, depth=0):
+def _single_resource_json_response(resource, depth=0, expand=None,
+                                   fields=None):
     """Return the JSON representation of *resource*.
 
     :param resource: :class:`sandman.model.Model` to render
     :type resource: :class:`sandman.model.Model`
+    :param int depth: depth to which related resources are expanded
+    :param dict expand: tree of the names of related resources to expand
+    :param list fields: names of the columns to render (default: all)
     :rtype: :class:`flask.Response`
 
     """
     links = resource.links()
-    response = jsonify(**resource.as_dict(depth))
+    response = jsonify(**resource.as_dict(depth, expand, fields))
     response.headers['Link'] = ''
     for link in links:
         response.headers['Link'] += '<{}>; rel="{}",'.format(
@@ -118,60 +344,222 @@ def _single_attribute_html_response(resource, name, value):
         name=name, value=value))
 
 
-def _single_resource_html_response(resource):
+def _single_resource_html_response(resource, fields=None):
     """Return the HTML representation of *resource*.
 
     :param resource: :class:`sandman.model.Model` to render
     :type resource: :class:`sandman.model.Model`
+    :param list fields: names of the columns to render (default: all)
     :rtype: :class:`flask.Response`
 
     """
     tablename = resource.__tablename__
     resource.pk = getattr(resource, resource.primary_key())
-    resource.attributes = resource.as_dict()
+    resource.attributes = resource.as_dict(fields=fields)
     return make_response(render_template(
         'resource.html',
         resource=resource,
         tablename=tablename))
 
 
-def _collection_json_response(cls, resources, start, stop, depth=0):
+def _collection_json_response(cls, resources, links=None, depth=0,
+                              expand=None, fields=None):
     """Return the JSON representation of the collection *resources*.
 
     :param list resources: list of :class:`sandman.model.Model`s to render
+    :param list links: pagination links (``next``/``prev``) for the collection
+    :param int depth: depth to which related resources are expanded
+    :param dict expand: tree of the names of related resources to expand
+    :param list fields: names of the columns to render (default: all)
     :rtype: :class:`flask.Response`
 
     """
 
-    top_level_json_name = None
-    if cls.__top_level_json_name__ is not None:
-        top_level_json_name = cls.__top_level_json_name__
-    else:
-        top_level_json_name = 'resources'
+    top_level_json_name = _top_level_json_name(cls)
 
     result_list = []
     for resource in resources:
-        result_list.append(resource.as_dict(depth))
+        result_list.append(resource.as_dict(depth, expand, fields))
 
-    payload = {}
-    if start is not None:
-        payload[top_level_json_name] = result_list[start:stop]
-    else:
-        payload[top_level_json_name] = result_list
+    payload = {top_level_json_name: result_list}
+    if links:
+        payload['links'] = links
 
     return jsonify(payload)
 
 
-def _collection_html_response(resources, start=0, stop=20):
+def _top_level_json_name(cls):
+    """Return the name of the top-level JSON element for collections of
+    *cls*."""
+    if cls.__top_level_json_name__ is not None:
+        return cls.__top_level_json_name__
+    return 'resources'
+
+
+def _stream_collection(resources):
+    """Return *resources* as a query which is read from a server-side cursor,
+    ``SANDMAN_STREAM_BATCH_SIZE`` rows at a time, rather than fetched in full.
+
+    :param resources: query for the resources of a collection
+    :type resources: :class:`sqlalchemy.orm.query.Query`
+    :rtype: :class:`sqlalchemy.orm.query.Query`
+
+    """
+    batch_size = app.config.get('SANDMAN_STREAM_BATCH_SIZE', 1000)
+    return resources.execution_options(stream_results=True).yield_per(
+        batch_size)
+
+
+def _collection_json_stream_response(cls, resources, depth=0, fields=None):
+    """Return the JSON representation of the collection *resources* as a
+    streamed response.
+
+    The JSON document is identical to that of
+    :func:`_collection_json_response`, but it is encoded and sent one
+    resource at a time as rows arrive from the database, so memory use does
+    not depend on the size of the collection.
+
+    :param resources: resources to render, usually a query returned by
+                      :func:`_stream_collection`
+    :param list fields: names of the columns to render (default: all)
+    :rtype: :class:`flask.Response`
+
+    """
+    encoder = current_app.json_encoder()
+
+    def generate():
+        """Yield the JSON document one resource at a time."""
+        yield '{{{}: ['.format(encoder.encode(_top_level_json_name(cls)))
+        separator = ''
+        for resource in resources:
+            yield separator + encoder.encode(
+                resource.as_dict(depth, fields=fields))
+            separator = ', '
+        yield ']}'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/json')
+
+
+def _collection_ndjson_response(resources, depth=0, fields=None):
+    """Return the collection *resources* as newline-delimited JSON, one
+    resource per line, streamed as rows arrive from the database.
+
+    :param resources: resources to render, usually a query returned by
+                      :func:`_stream_collection`
+    :param list fields: names of the columns to render (default: all)
+    :rtype: :class:`flask.Response`
+
+    """
+    encoder = current_app.json_encoder()
+
+    def generate():
+        """Yield one JSON-encoded resource per line."""
+        for resource in resources:
+            yield encoder.encode(
+                resource.as_dict(depth, fields=fields)) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson')
+
+
+class _CSVLine(object):
+    """File-like object which hands each line written by a
+    :func:`csv.writer` straight back to the caller."""
+
+    @staticmethod
+    def write(line):
+        """Return *line* rather than storing it."""
+        return line
+
+
+def _csv_row(values):
+    """Return the row of *values* as :func:`csv.writer` takes it. Python 2's
+    csv module only writes byte strings, so text is encoded as UTF-8 there.
+
+    :param list values: values of the row's columns
+    :rtype: list
+
+    """
+    if bytes is str:
+        return [value.encode('utf-8') if isinstance(value, type(u''))
+                else value for value in values]
+    return values
+
+
+def _collection_csv_response(cls, resources, fields=None):
+    """Return the collection *resources* as CSV, streamed as rows arrive from
+    the database.
+
+    The header row lists the columns of *cls*'s table (or those of them in
+    *fields*); each resource is written as the values of those columns.
+
+    :param resources: resources to render, usually a query returned by
+                      :func:`_stream_collection`
+    :param list fields: names of the columns to render (default: all)
+    :rtype: :class:`flask.Response`
+
+    """
+    columns = [column for column in cls.__table__.columns.keys() if
+               fields is None or column in fields]
+    writer = csv.writer(_CSVLine())
+
+    def generate():
+        """Yield the header row followed by one row per resource."""
+        yield writer.writerow(_csv_row(columns))
+        for resource in resources:
+            yield writer.writerow(_csv_row(
+                [getattr(resource, column, None) for column in columns]))
+
+    return Response(stream_with_context(generate()), mimetype='text/csv')
+
+
+def _collection_html_response(resources, links=None, fields=None):
     """Return the HTML representation of the collection *resources*.
 
     :param list resources: list of :class:`sandman.model.Model`s to render
+    :param list links: pagination links (``next``/``prev``) for the collection
+    :param list fields: names of the columns to render (default: all)
     :rtype: :class:`flask.Response`
 
     """
+    for resource in resources:
+        resource.attributes = resource.as_dict(fields=fields)
     return make_response(render_template(
         'collection.html',
-        resources=resources[start:stop]))
+        resources=resources,
+        links=links or []))
+
+
+def _page_uri(page):
+    """Return the URI of page *page* of the collection in the current request,
+    preserving all other query arguments.
+
+    :param int page: page number to link to
+    :rtype: string
+
+    """
+    arguments = request.args.copy()
+    arguments['page'] = str(page)
+    return '{}?{}'.format(request.path, url_encode(arguments))
+
+
+def _page_links(page, has_next):
+    """Return the ``prev`` and ``next`` links for page *page* of a collection.
+
+    :param int page: the current page number
+    :param bool has_next: is there at least one resource past this page?
+    :rtype: list
+
+    """
+    links = []
+    if page > 0:
+        links.append({'rel': 'prev', 'uri': _page_uri(page - 1)})
+    if has_next:
+        links.append({'rel': 'next', 'uri': _page_uri(page + 1)})
+    return links
 
 
 def _validate(cls, method, resource=None):
@@ -207,10 +595,15 @@ def get_resource_data(incoming_request):
     if ('Content-type' not in incoming_request.headers or
             content_type in JSON_CONTENT_TYPES):
         return incoming_request.json
+    elif (incoming_request.method == 'PATCH' and content_type in
+          MERGE_PATCH_CONTENT_TYPES | JSON_PATCH_CONTENT_TYPES):
+        return incoming_request.get_json(force=True)
     elif content_type in HTML_CONTENT_TYPES:
         if not incoming_request.form:
             raise InvalidAPIUsage(400)
-        return incoming_request.form
+        # An empty form field means no value was given
+        return dict((name, value)
+                    for name, value in incoming_request.form.items() if value)
     else:
         # HTTP 415: Unsupported Media Type
         raise InvalidAPIUsage(
@@ -227,63 +620,644 @@ def endpoint_class(collection):
     :rtype: :class:`sandman.model.Model`
 
     """
-    with app.app_context():
+    cls = reflect_endpoint_class(db, collection)
+    if cls is None:
         try:
             cls = current_app.class_references[collection]
         except KeyError:
             raise InvalidAPIUsage(404)
-        return cls
+    return cls
+
+
+def _get_fields(cls, query_arguments):
+    """Return the names of the columns requested in the ``fields`` query
+    argument, or ``None`` if all columns were requested.
+
+    :param cls: class associated with the request's endpoint
+    :param dict query_arguments: query arguments of the current request
+    :rtype: list or None
+
+    """
+    if not query_arguments or not query_arguments.get('fields'):
+        return None
+    columns = cls.__table__.columns.keys()
+    fields = [field.strip() for field in query_arguments['fields'].split(',')]
+    for field in fields:
+        if field not in columns:
+            raise InvalidAPIUsage(400, INVALID_FIELD_MESSAGE.format(
+                field, cls.endpoint()))
+    return fields
+
+
+def _load_fields(cls, fields):
+    """Return the query option restricting the columns selected for *cls* to
+    *fields*.
+
+    The primary key and foreign key columns are always selected, since links
+    to the resource and its related resources are rendered regardless of
+    *fields*.
+
+    :param cls: class associated with the request's endpoint
+    :param list fields: names of the columns to select
+    :rtype: :class:`sqlalchemy.orm.strategy_options.Load`
+
+    """
+    columns = cls.__table__.columns.keys()
+    selected = set(fields)
+    selected.add(cls.primary_key())
+    selected.update(
+        column for _, column, _ in cls.related_endpoints() if
+        column in columns)
+    return load_only(*selected)
+
+
+def _get_page(query_arguments):
+    """Return the (zero-based) page number requested in *query_arguments*, or
+    ``None`` if no page was requested.
+
+    :param dict query_arguments: query arguments of the current request
+    :rtype: int or None
+
+    """
+    if not query_arguments or 'page' not in query_arguments:
+        return None
+    try:
+        page = int(query_arguments['page'])
+    except ValueError:
+        raise InvalidAPIUsage(400, 'Invalid page [{}]'.format(
+            query_arguments['page']))
+    if page < 0:
+        raise InvalidAPIUsage(400, 'Invalid page [{}]'.format(page))
+    return page
+
+
+def _encode_cursor(values):
+    """Return an opaque cursor encoding the keyset *values* of a resource.
+
+    :param list values: the sort column value (if any) and primary key value
+    :rtype: string
+
+    """
+    encoded = json.dumps(values, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(encoded).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    """Return the keyset values encoded in the opaque *cursor*.
+
+    :param string cursor: cursor previously returned by :func:`_encode_cursor`
+    :rtype: list
+
+    """
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise InvalidAPIUsage(400, INVALID_CURSOR_MESSAGE.format(cursor))
+    if not isinstance(values, list) or len(values) not in (1, 2):
+        raise InvalidAPIUsage(400, INVALID_CURSOR_MESSAGE.format(cursor))
+    return values
+
+
+def _nulls_sort_low():
+    """Return ``True`` if the database sorts NULLs before every other value in
+    ascending order (and after them in descending order), as SQLite, MySQL
+    and SQL Server do, or ``False`` if it sorts them after, as PostgreSQL and
+    Oracle do.
+
+    :rtype: bool
+
+    """
+    return db.engine.dialect.name not in ('postgresql', 'oracle')
+
+
+def _keyset_criterion(cls, cursor, params, sort=None):
+    """Return the 'where' clause selecting the resources of *cls* which sort
+    after the position encoded in *cursor*.
+
+    Resources are ordered by primary key, or by ``(sort, primary key)`` if
+    a *sort* column is given. NULLs in the *sort* column, which no comparison
+    matches, are selected explicitly, wherever the database's own ordering
+    puts them.
+
+    :param cls: class associated with the request's endpoint
+    :param string cursor: cursor previously returned by :func:`_encode_cursor`
+    :param dict params: bound parameter values, added to by this function
+    :param tuple sort: ``(name, descending)`` of the column the collection is
+                       sorted by
+    :rtype: :class:`sqlalchemy.sql.expression.ClauseElement`
+
+    """
+    values = _decode_cursor(cursor)
+    primary_key_name = cls.primary_key()
+    primary_key = getattr(cls, primary_key_name)
+    last_key = _bind(cls, primary_key_name, _coerce_value(
+        cls, primary_key_name, values[-1]), params)
+    if sort is None:
+        return primary_key > last_key
+    if len(values) != 2:
+        raise InvalidAPIUsage(400, INVALID_CURSOR_MESSAGE.format(cursor))
+    name, descending = sort
+    sort_column = getattr(cls, name)
+    nulls_last = _nulls_sort_low() == descending
+    if values[0] is None:
+        past_nulls = and_(sort_column.is_(None), primary_key > last_key)
+        if nulls_last:
+            return past_nulls
+        return or_(sort_column.isnot(None), past_nulls)
+    last_value = _bind(
+        cls, name, _coerce_value(cls, name, values[0]), params)
+    if descending:
+        past_value = sort_column < last_value
+    else:
+        past_value = sort_column > last_value
+    criteria = [
+        past_value,
+        and_(sort_column == last_value, primary_key > last_key)]
+    if nulls_last:
+        criteria.append(sort_column.is_(None))
+    return or_(*criteria)
+
+
+def _cursor_for(resource, sort=None):
+    """Return the cursor positioned just after *resource*.
+
+    :param resource: last resource of the current page
+    :type resource: :class:`sandman.model.Model`
+    :param tuple sort: ``(name, descending)`` of the column the collection is
+                       sorted by
+    :rtype: string
+
+    """
+    values = [getattr(resource, resource.primary_key())]
+    if sort is not None:
+        values.insert(0, getattr(resource, sort[0]))
+    return _encode_cursor(values)
+
+
+def _cursor_links(resources, has_next, sort=None):
+    """Return the ``next`` link for a page of a collection retrieved in cursor
+    mode.
+
+    :param list resources: resources on the current page
+    :param bool has_next: is there at least one resource past this page?
+    :param tuple sort: ``(name, descending)`` of the column the collection is
+                       sorted by
+    :rtype: list
+
+    """
+    if not (has_next and resources):
+        return []
+    arguments = request.args.copy()
+    arguments['after'] = _cursor_for(resources[-1], sort)
+    return [{'rel': 'next', 'uri': '{}?{}'.format(
+        request.path, url_encode(arguments))}]
+
+
+def _get_column_name(cls, name):
+    """Return *name* if it is the name of one of *cls*'s columns, otherwise
+    raise an :class:`InvalidAPIUsage` exception.
+
+    :param cls: class associated with the request's endpoint
+    :param string name: name of the column
+    :rtype: string
+
+    """
+    if name not in cls.__table__.columns.keys():
+        raise InvalidAPIUsage(400, INVALID_FIELD_MESSAGE.format(
+            name, cls.endpoint()))
+    return name
+
+
+def _coerce_value(cls, name, value):
+    """Return the string *value* converted to the Python type of *cls*'s
+    column *name*, so it is bound to the query with the column's own type
+    (and the column's indexes can be used).
+
+    :param cls: class associated with the request's endpoint
+    :param string name: name of the column
+    :param string value: value taken from the request
+    :rtype: the column's Python type
+
+    """
+    if not isinstance(value, (str, type(u''))):
+        return value
+    column_type = cls.__table__.columns[name].type
+    if isinstance(column_type, String):
+        return value
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type is bool:
+            return _coerce_value_as_bool(value, name)
+        elif python_type in (datetime.datetime, datetime.date):
+            for datetime_format in DATETIME_FORMATS:
+                try:
+                    parsed = datetime.datetime.strptime(value, datetime_format)
+                except ValueError:
+                    continue
+                if python_type is datetime.date:
+                    return parsed.date()
+                return parsed
+            raise ValueError(value)
+        elif python_type is Decimal:
+            return Decimal(value)
+        return python_type(value)
+    except (ValueError, ArithmeticError):
+        raise InvalidAPIUsage(400, INVALID_VALUE_MESSAGE.format(value, name))
+
+
+def _bind(cls, name, value, params):
+    """Return a bound parameter of the type of *cls*'s column *name*, adding
+    *value* to *params* as its value.
+
+    Binding every value (rather than embedding it in the query) keeps the
+    SQL identical between requests that differ only in their values.
+
+    :param cls: class associated with the request's endpoint
+    :param string name: name of the column
+    :param value: value to bind
+    :param dict params: bound parameter values, added to by this function
+    :rtype: :class:`sqlalchemy.sql.expression.BindParameter`
+
+    """
+    key = 'sandman_{}'.format(len(params))
+    params[key] = value
+    return bindparam(key, type_=cls.__table__.columns[name].type)
+
+
+def _split_filter_key(key):
+    """Return the ``(column name, operator)`` of the filter query argument
+    *key*; the operator is ``None`` for an equality filter.
+
+    :param string key: name of the query argument
+    :rtype: tuple
+
+    """
+    if '__' not in key:
+        return key, None
+    name, operator = key.rsplit('__', 1)
+    if operator not in FILTER_OPERATORS:
+        raise InvalidAPIUsage(400, INVALID_OPERATOR_MESSAGE.format(
+            operator, name))
+    return name, operator
+
+
+def _filter_criterion(cls, key, value, params):
+    """Return the 'where' clause for the filter query argument *key*.
+
+    *key* is either a column name, to filter on equality (or a LIKE match if
+    *value* starts with ``%``), or a column name and one of
+    :data:`FILTER_OPERATORS` separated by a double underscore.
+
+    :param cls: class associated with the request's endpoint
+    :param string key: name of the query argument
+    :param string value: value of the query argument
+    :param dict params: bound parameter values, added to by this function
+    :rtype: :class:`sqlalchemy.sql.expression.ClauseElement`
+
+    """
+    name, operator = _split_filter_key(key)
+    column = getattr(cls, _get_column_name(cls, name))
+    if operator is None:
+        if value.startswith('%'):
+            return column.like(_bind(cls, name, value, params), escape='/')
+        return column == _bind(
+            cls, name, _coerce_value(cls, name, value), params)
+    elif operator == 'isnull':
+        if _coerce_value_as_bool(value, name):
+            return column.is_(None)
+        return column.isnot(None)
+    elif operator == 'startswith':
+        escaped = value.replace('/', '//').replace('%', '/%').replace(
+            '_', '/_')
+        return column.like(
+            _bind(cls, name, escaped + '%', params), escape='/')
+    elif operator in ('in', 'between'):
+        values = [
+            _bind(cls, name, _coerce_value(cls, name, item), params)
+            for item in value.split(',')]
+        if operator == 'in':
+            return column.in_(values)
+        if len(values) != 2:
+            raise InvalidAPIUsage(400, INVALID_VALUE_MESSAGE.format(
+                value, key))
+        return column.between(*values)
+    value = _bind(cls, name, _coerce_value(cls, name, value), params)
+    if operator == 'gt':
+        return column > value
+    elif operator == 'gte':
+        return column >= value
+    elif operator == 'lt':
+        return column < value
+    return column <= value
+
+
+def _coerce_value_as_bool(value, name):
+    """Return the string *value* as a boolean.
+
+    :param string value: value taken from the request
+    :param string name: name of the query argument, for error messages
+    :rtype: bool
+
+    """
+    if value.lower() in ('true', '1'):
+        return True
+    elif value.lower() in ('false', '0'):
+        return False
+    raise InvalidAPIUsage(400, INVALID_VALUE_MESSAGE.format(value, name))
+
+
+def _collection_filters(cls, query_arguments, params):
+    """Return the list of 'where' clauses for the filter arguments (i.e. all
+    arguments but those in :data:`COLLECTION_ARGUMENTS`) in
+    *query_arguments*.
+
+    Filters are visited in order of name, so that the same set of filters
+    always produces the same statement.
+
+    :param cls: class associated with the request's endpoint
+    :param dict query_arguments: query arguments of the current request
+    :param dict params: bound parameter values, added to by this function
+    :rtype: list
+
+    """
+    filters = []
+    for key in sorted(query_arguments.keys()):
+        if key and key not in COLLECTION_ARGUMENTS:
+            filters.append(_filter_criterion(
+                cls, key, query_arguments[key], params))
+    return filters
+
+
+def _query_shape(collection, query_arguments):
+    """Return the key under which the statement for a query of *collection*
+    with *query_arguments* is cached.
+
+    The key holds everything which changes the SQL of the statement: the
+    names and operators of the filters (plus, where they alter the SQL, the
+    number of ``in`` values, whether ``isnull`` is true and whether an
+    equality filter is a LIKE match), and the sort, fields and paging
+    arguments (and whether a cursor is at a NULL). The values of the filters
+    themselves are bound parameters and aren't part of the key. ``limit``
+    and ``page`` are, since SQLAlchemy renders LIMIT and OFFSET from integers
+    rather than bound parameters.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :param dict query_arguments: query arguments of the current request
+    :rtype: tuple
+
+    """
+    shape = [collection]
+    for key in sorted(query_arguments.keys()):
+        value = query_arguments[key]
+        if key == 'expand':
+            continue
+        elif key in COLLECTION_ARGUMENTS:
+            if key == 'after':
+                # A cursor at a NULL is sought with different clauses
+                value = (bool(value),
+                         bool(value) and _decode_cursor(value)[0] is None)
+            shape.append((key, value))
+            continue
+        _, operator = _split_filter_key(key)
+        if operator is None:
+            shape.append((key, value.startswith('%')))
+        elif operator == 'in':
+            shape.append((key, value.count(',')))
+        elif operator == 'isnull':
+            shape.append((key, value.lower()))
+        else:
+            shape.append((key, None))
+    return tuple(shape)
+
+
+def _get_sort(cls, query_arguments):
+    """Return the ``(name, descending)`` pairs of the columns listed in the
+    ``sort`` query argument. A leading ``-`` sorts a column in descending
+    order.
+
+    :param cls: class associated with the request's endpoint
+    :param dict query_arguments: query arguments of the current request
+    :rtype: list
+
+    """
+    if not query_arguments or not query_arguments.get('sort'):
+        return []
+    sort = []
+    for name in query_arguments['sort'].split(','):
+        name = name.strip()
+        descending = name.startswith('-')
+        sort.append((_get_column_name(cls, name.lstrip('-')), descending))
+    return sort
+
+
+def _get_cursor_sort(cls, query_arguments):
+    """Return the single ``(name, descending)`` sort column allowed in cursor
+    mode, or ``None`` if the collection is ordered by primary key only.
+
+    :param cls: class associated with the request's endpoint
+    :param dict query_arguments: query arguments of the current request
+    :rtype: tuple or None
+
+    """
+    sort = _get_sort(cls, query_arguments)
+    if len(sort) > 1:
+        raise InvalidAPIUsage(
+            400, 'Only one [sort] column may be combined with [after]')
+    return sort[0] if sort else None
+
+
+def _get_limit(query_arguments):
+    """Return the ``limit`` requested in *query_arguments*, or ``None``.
+
+    :param dict query_arguments: query arguments of the current request
+    :rtype: int or None
+
+    """
+    if not query_arguments or 'limit' not in query_arguments:
+        return None
+    try:
+        limit = int(query_arguments['limit'])
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        raise InvalidAPIUsage(400, 'Invalid limit [{}]'.format(
+            query_arguments['limit']))
+    return limit
 
 
 def retrieve_collection(collection, query_arguments=None):
-    """Return the resources in *collection*, possibly filtered by a series of
-    values to use in a 'where' clause search.
+    """Return a query for the resources in *collection*, possibly filtered by
+    a series of values to use in a 'where' clause search.
+
+    Filters are given as ``column=value`` or ``column__operator=value`` (see
+    :data:`FILTER_OPERATORS`), with values converted to the column's type.
+    Unknown columns are rejected with a *400*.
+
+    If a ``page`` is requested, it is applied to the query as a LIMIT/OFFSET.
+    If a cursor is given in ``after``, the query instead seeks directly past
+    the resource the cursor was created from, ordered by primary key (or by
+    ``sort`` and primary key), with ``limit`` as the page size. In both cases
+    one resource more than the page size is selected so the caller can
+    tell whether a following page exists without counting the collection.
+
+    The statement built for each shape of query (see :func:`_query_shape`)
+    is kept in the query cache, so later queries of the same shape only bind
+    new values rather than building and compiling the SQL again.
 
     :param string collection: a :class:`sandman.model.Model` endpoint
     :param dict query_arguments: a list of filter query arguments
-    :rtype: class:`sandman.model.Model`
+    :rtype: :class:`sqlalchemy.orm.query.Query`
 
     """
     session = _get_session()
     cls = endpoint_class(collection)
+    resources = session.query(cls)
     if query_arguments:
-        filters = []
+        params = {}
+        filters = _collection_filters(cls, query_arguments, params)
+        if query_arguments.get('after'):
+            filters.append(_keyset_criterion(
+                cls, query_arguments['after'], params,
+                _get_cursor_sort(cls, query_arguments)))
+        query_cache = _get_query_cache()
+        shape = _query_shape(collection, query_arguments)
+        statement = query_cache.get(shape)
+        if statement is not None:
+            return _cached_query(cls, statement, params)
         order = []
-        limit = None
-        for key, value in query_arguments.items():
-            if key == 'page':
-                continue
-            if value.startswith('%'):
-                filters.append(getattr(cls, key).like(str(value), escape='/'))
-            elif key == 'sort':
-                order.append(getattr(cls, value))
-            elif key == 'limit':
-                limit = value
-            elif key:
-                filters.append(getattr(cls, key) == value)
-        resources = session.query(cls).filter(*filters).order_by(
-            *order).limit(limit)
-    else:
-        resources = session.query(cls).all()
+        for name, descending in _get_sort(cls, query_arguments):
+            column = getattr(cls, name)
+            order.append(column.desc() if descending else column)
+        limit = _get_limit(query_arguments)
+        page = _get_page(query_arguments)
+        offset = None
+        if 'after' in query_arguments:
+            if page is not None:
+                raise InvalidAPIUsage(
+                    400, 'Cannot combine [page] with [after]')
+            order.append(getattr(cls, cls.primary_key()))
+            if limit is None:
+                limit = app.config.get('RESULTS_PER_PAGE', 20)
+            limit += 1
+        elif page is not None:
+            results_per_page = app.config.get('RESULTS_PER_PAGE', 20)
+            offset = page * results_per_page
+            page_limit = results_per_page + 1
+            if limit is not None:
+                page_limit = max(min(page_limit, limit - offset), 0)
+            # Without a total order, rows may move between pages
+            order.append(getattr(cls, cls.primary_key()))
+            limit = page_limit
+        resources = resources.filter(*filters).order_by(*order)
+        resources = resources.limit(limit).offset(offset)
+        fields = _get_fields(cls, query_arguments)
+        if fields is not None:
+            resources = resources.options(_load_fields(cls, fields))
+        if query_cache.statements.max_size:
+            statement = resources.statement
+            query_cache.set(shape, statement)
+            return _cached_query(cls, statement, params)
+        resources = resources.params(params)
     return resources
 
 
-def retrieve_resource(collection, key):
+def _cached_query(cls, statement, params):
+    """Return a query for the resources of *cls* selected by the cached
+    *statement*, with *params* as the values of its bound parameters.
+
+    :param cls: class associated with the request's endpoint
+    :param statement: statement previously built for the same query shape
+    :type statement: :class:`sqlalchemy.sql.expression.Select`
+    :param dict params: values of the statement's bound parameters
+    :rtype: :class:`sqlalchemy.orm.query.Query`
+
+    """
+    return _get_session().query(cls).from_statement(statement).params(
+        params).execution_options(
+            compiled_cache=_get_query_cache().compiled)
+
+
+def retrieve_resource(collection, key, fields=None):
     """Return the resource in *collection* identified by key *key*.
 
     :param string collection: a :class:`sandman.model.Model` endpoint
     :param string key: primary key of resource
+    :param list fields: names of the only columns to select (default: all)
     :rtype: class:`sandman.model.Model`
 
     """
     session = _get_session()
     cls = endpoint_class(collection)
-    resource = session.query(cls).get(key)
+    query = session.query(cls)
+    if fields is not None:
+        query = query.options(_load_fields(cls, fields))
+    try:
+        # Resources already in the identity map are keyed by the primary
+        # key's own type, not by the string taken from the URL
+        key = _coerce_value(cls, cls.primary_key(), key)
+    except InvalidAPIUsage:
+        raise InvalidAPIUsage(404)
+    resource = query.get(key)
     if resource is None:
         raise InvalidAPIUsage(404)
     return resource
 
 
+def _validate_expansion(cls, expand):
+    """Raise an :class:`InvalidAPIUsage` exception if *expand* names a
+    related resource that *cls* doesn't have.
+
+    :param cls: class whose related resources are to be expanded
+    :param dict expand: tree of the names of related resources to expand
+
+    """
+    related = dict(
+        (name, endpoint) for name, _, endpoint in cls.related_endpoints())
+    for name, children in expand.items():
+        if name not in related:
+            raise InvalidAPIUsage(400, INVALID_EXPAND_MESSAGE.format(
+                name, cls.endpoint()))
+        _validate_expansion(related[name], children)
+
+
+def _get_expansion(cls):
+    """Return the ``(depth, expand)`` to which related resources of *cls*
+    should be expanded for the current request.
+
+    ``expand`` may be given as a flag (depth 1), a number (the depth to
+    which every related resource is expanded, at most
+    ``SANDMAN_MAX_EXPAND_DEPTH``) or a comma-separated list of dotted paths
+    of related resources (e.g. ``album,album.artist``), which is returned
+    as a tree of names.
+
+    :param cls: class associated with the request's endpoint
+    :rtype: tuple
+
+    """
+    if 'expand' not in request.args:
+        return 0, None
+    value = request.args['expand'].strip()
+    if not value:
+        return 1, None
+    if value.isdigit():
+        depth = int(value)
+        if depth > app.config.get('SANDMAN_MAX_EXPAND_DEPTH', 3):
+            raise InvalidAPIUsage(400, 'Expansion depth [{}] too large'.format(
+                depth))
+        return depth, None
+    expand = {}
+    for path in value.split(','):
+        node = expand
+        for name in path.strip().split('.'):
+            node = node.setdefault(name, {})
+    _validate_expansion(cls, expand)
+    return 0, expand
+
+
 def resource_created_response(resource):
     """Return HTTP response with status code *201*, signaling a created
     *resource*
@@ -303,18 +1277,35 @@ def resource_created_response(resource):
     return response
 
 
-def collection_response(cls, resources, start=None, stop=None):
+def collection_response(cls, resources, links=None):
     """Return a response for the *resources* of the appropriate content type.
 
     :param resources: resources to be returned in request
     :type resource: list of :class:`sandman.model.Model`
+    :param list links: pagination links (``next``/``prev``) for the collection
     :rtype: :class:`flask.Response`
 
     """
-    if _get_acceptable_response_type() == JSON:
-        return _collection_json_response(cls, resources, start, stop)
+    response_type = _get_collection_response_type()
+    fields = _get_fields(cls, request.args)
+    if response_type == JSON:
+        depth, expand = _get_expansion(cls)
+        # Keep a reference to the related resources until rendering is done
+        # pylint: disable=unused-variable
+        related = cls.load_related(resources, depth, expand)
+        response = _collection_json_response(
+            cls, resources, links, depth, expand, fields)
+    elif response_type == NDJSON:
+        response = _collection_ndjson_response(resources, fields=fields)
+    elif response_type == CSV:
+        response = _collection_csv_response(cls, resources, fields)
     else:
-        return _collection_html_response(resources, start, stop)
+        response = _collection_html_response(resources, links, fields)
+    if links:
+        response.headers['Link'] = ','.join(
+            '<{}>; rel="{}"'.format(link['uri'], link['rel'])
+            for link in links)
+    return response
 
 
 def resource_response(resource, depth=0):
@@ -325,13 +1316,15 @@ def resource_response(resource, depth=0):
     :rtype: :class:`flask.Response`
 
     """
+    fields = _get_fields(type(resource), request.args)
     if _get_acceptable_response_type() == JSON:
-        depth = 0
-        if 'expand' in request.args:
-            depth = 1
-        return _single_resource_json_response(resource, depth)
+        depth, expand = _get_expansion(type(resource))
+        # Keep a reference to the related resources until rendering is done
+        # pylint: disable=unused-variable
+        related = type(resource).load_related([resource], depth, expand)
+        return _single_resource_json_response(resource, depth, expand, fields)
     else:
-        return _single_resource_html_response(resource)
+        return _single_resource_html_response(resource, fields)
 
 
 def attribute_response(resource, name, value):
@@ -348,6 +1341,243 @@ def attribute_response(resource, name, value):
         return _single_attribute_html_response(resource, name, value)
 
 
+def _request_variant(response_type, view_arguments):
+    """Return the ``(cls, collection, key, variant)`` identifying the
+    representation requested by the current request.
+
+    *collection* is the canonical endpoint of *cls* (``None`` for the root
+    endpoint), *key* the primary key of the requested resource (``None`` for
+    collections), and *variant* the request's path, query string and the
+    content type negotiated by *response_type*.
+
+    :param response_type: function negotiating the type of the response
+    :param dict view_arguments: arguments the view is called with
+    :rtype: tuple
+
+    """
+    cls = None
+    collection = view_arguments.get('collection')
+    if collection is not None:
+        cls = endpoint_class(collection)
+        collection = cls.endpoint()
+    variant = (
+        request.path,
+        request.query_string,
+        response_type() if response_type else None)
+    return cls, collection, view_arguments.get('key'), variant
+
+
+def _weak_etag(*values):
+    """Return a weak ETag derived from *values*.
+
+    :rtype: string
+
+    """
+    return 'W/"{}"'.format(
+        hashlib.md5(repr(values).encode('utf-8')).hexdigest())
+
+
+def _version_etag(cls, key, variant):
+    """Return the ETag of the resource *key* of *cls*, derived from its
+    ``__version_column__`` without loading the rest of the row, or ``None``
+    if there is no such resource.
+
+    :param cls: class associated with the request's endpoint
+    :param string key: the primary key of the resource
+    :param tuple variant: the requested representation of the resource
+    :rtype: string or None
+
+    """
+    try:
+        key = _coerce_value(cls, cls.primary_key(), key)
+    except InvalidAPIUsage:
+        return None
+    version = _get_session().query(
+        getattr(cls, cls.__version_column__)).filter(
+            getattr(cls, cls.primary_key()) == key).first()
+    if version is None:
+        return None
+    return _weak_etag(version[0], variant)
+
+
+def generation_etag(response_type=None):
+    """Give the decorated GET view's responses a weak ETag computed without
+    running the view, answering a matching ``If-None-Match`` with ``304``
+    before anything is queried or rendered.
+
+    The ETag of a resource whose :class:`sandman.model.Model` has a
+    ``__version_column__`` is derived from that column. Otherwise, if
+    ``SANDMAN_GENERATION_ETAGS`` is set, ETags are derived from the write
+    generation of the resource (or collection); as generations only move on
+    when sandman itself handles a write, this must only be enabled if no one
+    else writes to the database. Requests with ``If-Match`` are left to
+    :func:`etag`, since only the strong ETag of the body can satisfy them.
+
+    :param response_type: function negotiating the type of the response
+    """
+    def decorator(view):
+        """Decorate *view*."""
+        @functools.wraps(view)
+        def wrapped(**kwargs):
+            """Return ``304`` if the client's representation is current, or
+            the response *view* returns with its ETag."""
+            if 'If-Match' in request.headers:
+                return view(**kwargs)
+            cls, collection, key, variant = _request_variant(
+                response_type, kwargs)
+            tag = None
+            if key is not None and cls.__version_column__:
+                tag = _version_etag(cls, key, variant)
+            elif app.config.get('SANDMAN_GENERATION_ETAGS', False):
+                tag = _weak_etag(
+                    _get_generations().stamp(collection, key), variant)
+            if tag is None:
+                return view(**kwargs)
+
+            if_none_match = request.headers.get('If-None-Match')
+            if if_none_match and etag_matches(tag, if_none_match):
+                return not_modified(tag)
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                response.headers['ETag'] = tag
+            return response
+        return wrapped
+    return decorator
+
+
+def _last_modified(collection=None, key=None, **_):
+    """Return the time the resource *key* of *collection* (or, without a
+    *key*, the collection itself) was last modified, or ``None`` if it isn't
+    known.
+
+    A resource whose :class:`sandman.model.Model` has a
+    ``__last_modified_column__`` is last modified when that column says.
+    Otherwise, if ``SANDMAN_TRACK_LAST_MODIFIED`` is set, it is the time of
+    the last write handled by sandman; as with ``SANDMAN_GENERATION_ETAGS``,
+    this must only be enabled if no one else writes to the database.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :param string key: the primary key of the resource
+    :rtype: :class:`datetime.datetime`, float or None
+
+    """
+    if collection is None:
+        return None
+    cls = endpoint_class(collection)
+    if key is not None and cls.__last_modified_column__:
+        try:
+            key = _coerce_value(cls, cls.primary_key(), key)
+        except InvalidAPIUsage:
+            return None
+        modified = _get_session().query(
+            getattr(cls, cls.__last_modified_column__)).filter(
+                getattr(cls, cls.primary_key()) == key).first()
+        if modified is None or not isinstance(
+                modified[0], datetime.datetime):
+            return None
+        return modified[0]
+    if app.config.get('SANDMAN_TRACK_LAST_MODIFIED', False):
+        return _get_generations().last_modified(cls.endpoint(), key)
+    return None
+
+
+def _cache_directives(collection=None, **_):
+    """Return the ``Cache-Control`` directives for the response to the
+    current request.
+
+    They are made up from the ``__max_age__``, ``__s_maxage__``,
+    ``__stale_while_revalidate__`` and ``__cache_scope__`` of the
+    :class:`sandman.model.Model` of *collection*, overridden by the
+    directives given for the view handling the request (e.g.
+    ``get_meta``) in the ``SANDMAN_CACHE_CONTROL`` config value. If both
+    ``private`` and ``public`` are given, ``private`` wins.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :rtype: list
+
+    """
+    policy = {}
+    if collection is not None:
+        cls = endpoint_class(collection)
+        policy = {
+            'max-age': cls.__max_age__,
+            's-maxage': cls.__s_maxage__,
+            'stale-while-revalidate': cls.__stale_while_revalidate__,
+            }
+        if cls.__cache_scope__:
+            policy[cls.__cache_scope__] = True
+    policy.update(
+        app.config.get('SANDMAN_CACHE_CONTROL', {}).get(request.endpoint, {}))
+    if policy.get('private'):
+        policy['public'] = None
+
+    directives = []
+    for name in ('public', 'private', 'max-age', 's-maxage',
+                 'stale-while-revalidate'):
+        value = policy.get(name)
+        if value is True:
+            directives.append(name)
+        elif value is not None and value is not False:
+            directives.append('{}={}'.format(name, value))
+    return directives
+
+
+def cache_response(response_type=None):
+    """Serve the decorated GET view's responses from the response cache,
+    keyed on the request's path, query string and the content type returned
+    by *response_type*.
+
+    Responses are cached for the ``__cache_ttl__`` of the view's
+    :class:`sandman.model.Model` (``SANDMAN_RESPONSE_CACHE_TTL`` seconds, 60
+    by default, if it has none). Only complete ``200`` responses are cached.
+    Responses expanding related resources, which writes to those don't
+    invalidate, and those of Models with a ``validate_GET`` hook, which a
+    cached response would skip, are never cached.
+
+    :param response_type: function negotiating the type of the response
+    """
+    def decorator(view):
+        """Decorate *view*."""
+        @functools.wraps(view)
+        def wrapped(**kwargs):
+            """Return the cached response for this request, or cache the
+            response *view* returns."""
+            response_cache = _get_response_cache()
+            if response_cache is None or getattr(g, 'batch_writes', None):
+                # A response showing writes a batch may yet roll back
+                # mustn't be cached, and a cached one would hide them
+                return view(**kwargs)
+            cls, collection, key, variant = _request_variant(
+                response_type, kwargs)
+            ttl = app.config.get('SANDMAN_RESPONSE_CACHE_TTL', 60)
+            if cls is not None and cls.__cache_ttl__ is not None:
+                ttl = cls.__cache_ttl__
+            if (not ttl or request.args.get('expand') or
+                    hasattr(cls, 'validate_' + request.method)):
+                return view(**kwargs)
+
+            cached = response_cache.get(collection, key, variant)
+            if cached is not None:
+                data, status, headers, compressed_bodies = cached
+                response = Response(data, status, headers)
+                response.compressed_bodies = compressed_bodies
+                return response
+            stamp = response_cache.stamp(collection, key)
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                # Filled in by compress_response with the body compressed
+                # with each content coding it is requested in
+                response.compressed_bodies = {}
+                response_cache.set(
+                    collection, key, variant,
+                    (response.get_data(), response.status_code,
+                     list(response.headers), response.compressed_bodies),
+                    stamp, ttl)
+            return response
+        return wrapped
+    return decorator
+
+
 @no_cache
 def no_content_response():
     """Return the appropriate *Response* with status code *204*, signaling a
@@ -394,22 +1624,225 @@ def patch_resource(collection, key):
 
     """
     cls = endpoint_class(collection)
+    data = get_resource_data(request)
 
-    try:
+    resource = None
+    if _json_patch_reads(data):
         resource = retrieve_resource(collection, key)
-    except InvalidAPIUsage:
-        resource = None
+
+    if not hasattr(cls, 'validate_' + request.method):
+        _validate(cls, request.method)
+        return _upsert_resource(
+            collection, key, _patch_values(cls, data, resource))
+
+    if resource is None:
+        try:
+            resource = retrieve_resource(collection, key)
+        except InvalidAPIUsage:
+            resource = None
 
     _validate(cls, request.method, resource)
 
+    values = _patch_values(cls, data, resource)
     if resource is None:
         resource = cls()
-        resource.from_dict(get_resource_data(request))
+        resource.from_dict(values)
         setattr(resource, resource.primary_key(), key)
         _perform_database_action('add', resource)
         return resource_created_response(resource)
     else:
-        return update_resource(resource, request)
+        resource.from_dict(values)
+        _perform_database_action('merge', resource)
+        return no_content_response()
+
+
+def _patch_values(cls, data, resource=None):
+    """Return the values of the columns of *cls* written by a ``PATCH`` of
+    *data*: the members of a JSON object (or merge patch) naming columns,
+    ``null`` clearing a column, or the result of a JSON Patch.
+
+    :param cls: class associated with the request's endpoint
+    :param data: the body of the request
+    :param resource: the resource being patched, required by JSON Patch
+        operations which read it
+    :type resource: :class:`sandman.model.Model` or None
+    :rtype: dict
+
+    """
+    if request.mimetype in JSON_PATCH_CONTENT_TYPES:
+        return _json_patch_values(cls, data, resource)
+    if not isinstance(data, dict):
+        raise InvalidAPIUsage(400)
+    return dict((column, data[column])
+                for column in cls.__table__.columns.keys() if column in data)
+
+
+def _json_patch_reads(operations):
+    """Return ``True`` if the JSON Patch *operations* of the current request
+    read the resource being patched (i.e. include ``test``, ``move`` or
+    ``copy``).
+
+    :param operations: the body of the request
+    :rtype: bool
+
+    """
+    return request.mimetype in JSON_PATCH_CONTENT_TYPES and isinstance(
+        operations, list) and any(
+            isinstance(operation, dict) and
+            operation.get('op') in ('test', 'move', 'copy')
+            for operation in operations)
+
+
+def _json_patch_column(cls, operation, member):
+    """Return the name of the column of *cls* the JSON Pointer in
+    *operation*'s *member* (``path`` or ``from``) refers to.
+
+    Resources are flat, so the pointer must be a single reference token.
+
+    :param cls: class associated with the request's endpoint
+    :param dict operation: a JSON Patch operation
+    :param string member: ``'path'`` or ``'from'``
+    :rtype: string
+
+    """
+    pointer = operation.get(member)
+    if (not isinstance(pointer, (str, type(u''))) or
+            not pointer.startswith('/') or '/' in pointer[1:]):
+        raise InvalidAPIUsage(400, INVALID_PATCH_MESSAGE.format(operation))
+    return _get_column_name(
+        cls, pointer[1:].replace('~1', '/').replace('~0', '~'))
+
+
+def _json_patch_values(cls, operations, resource=None):
+    """Return the values of the columns of *cls* written by the JSON Patch
+    (RFC 6902) *operations*, applied in order to *resource*.
+
+    ``remove`` clears a column (sets it to ``None``), since a resource always
+    has every one of its columns. A failed ``test`` fails the whole patch
+    with a 409.
+
+    :param cls: class associated with the request's endpoint
+    :param list operations: the JSON Patch
+    :param resource: the resource being patched, required if
+        :func:`_json_patch_reads` the *operations*
+    :type resource: :class:`sandman.model.Model` or None
+    :rtype: dict
+
+    """
+    if not isinstance(operations, list):
+        raise InvalidAPIUsage(400)
+    values = {}
+
+    def current(name):
+        """Return the value of the column *name* as patched so far."""
+        if name in values:
+            return values[name]
+        return getattr(resource, name)
+
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise InvalidAPIUsage(400, INVALID_PATCH_MESSAGE.format(operation))
+        name = _json_patch_column(cls, operation, 'path')
+        action = operation.get('op')
+        if action in ('add', 'replace', 'test') and 'value' not in operation:
+            raise InvalidAPIUsage(400, INVALID_PATCH_MESSAGE.format(operation))
+        if action in ('add', 'replace'):
+            values[name] = operation['value']
+        elif action == 'remove':
+            values[name] = None
+        elif action in ('move', 'copy'):
+            source = _json_patch_column(cls, operation, 'from')
+            values[name] = current(source)
+            if action == 'move' and source != name:
+                values[source] = None
+        elif action == 'test':
+            value, expected = current(name), operation['value']
+            # Compare as rendered, since e.g. decimals are sent as strings
+            if value != expected and (value is None or expected is None or
+                                      str(value) != str(expected)):
+                raise InvalidAPIUsage(409, FAILED_TEST_MESSAGE.format(
+                    operation['path']))
+        else:
+            raise InvalidAPIUsage(400, INVALID_PATCH_MESSAGE.format(operation))
+    return values
+
+
+def _expire_resource(session, cls, key):
+    """Expire the resource of type *cls* identified by *key* if *session*
+    has loaded it, since it has just been written without going through the
+    session (a batch's sub-requests share their session).
+
+    :param session: the current request's session
+    :param cls: class associated with the request's endpoint
+    :param key: primary key of the resource
+
+    """
+    resource = session.identity_map.get(identity_key(cls, key))
+    if resource is not None:
+        session.expire(resource)
+
+
+def _write_by_key(cls, key, write):
+    """Perform *write* on the resource of type *cls* identified by *key*
+    without loading it first, and return a :func:`no_content_response`, or
+    raise a 404 if there is no such resource.
+
+    :param cls: class associated with the request's endpoint
+    :param string key: the primary key for the :class:`sandman.model.Model`
+    :param write: function given a query for the resource, performing the
+        write in a single statement and returning the row count
+    :rtype: :class:`flask.Response`
+
+    """
+    primary_key = cls.primary_key()
+    try:
+        key = _coerce_value(cls, primary_key, key)
+    except InvalidAPIUsage:
+        raise InvalidAPIUsage(404)
+    session = _get_session()
+    try:
+        affected = write(
+            session.query(cls).filter(getattr(cls, primary_key) == key))
+        _commit(session)
+    except IntegrityError as exception:
+        session.rollback()
+        raise InvalidAPIUsage(422, FORWARDED_EXCEPTION_MESSAGE.format(
+            exception))
+    if not affected:
+        raise InvalidAPIUsage(404)
+    _expire_resource(session, cls, key)
+    _bump_generation(cls.endpoint(), str(key))
+    return no_content_response()
+
+
+def _upsert_resource(collection, key, values):
+    """Create or update the resource in *collection* identified by *key* with
+    the column *values*, without loading it first, and return the
+    appropriate response. Only the columns in *values* are updated.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :param string key: the primary key for the :class:`sandman.model.Model`
+    :param dict values: values of the columns to write, by name
+    :rtype: :class:`flask.Response`
+
+    """
+    cls = endpoint_class(collection)
+    primary_key = cls.primary_key()
+    key = _coerce_value(cls, primary_key, key)
+    values = dict((column, value) for column, value in values.items()
+                  if column != primary_key)
+    session = _get_session()
+    try:
+        created = upsert(session, cls.__table__, primary_key, key, values)
+        _commit(session)
+    except IntegrityError as exception:
+        raise InvalidAPIUsage(422, FORWARDED_EXCEPTION_MESSAGE.format(
+            exception))
+    _expire_resource(session, cls, key)
+    _bump_generation(cls.endpoint(), str(key))
+    if created:
+        return resource_created_response(retrieve_resource(collection, key))
+    return no_content_response()
 
 
 @app.route('/<collection>/<key>', methods=['PUT'])
@@ -421,9 +1854,22 @@ def put_resource(collection, key):
     :rtype: :class:`flask.Response`
 
     """
+    cls = endpoint_class(collection)
+    if not hasattr(cls, 'validate_' + request.method):
+        _validate(cls, request.method)
+        data = get_resource_data(request)
+        # As :meth:`sandman.model.Model.replace` does, but keeping the key
+        # unless a new one is given
+        values = dict(
+            (getattr(cls, column), data.get(column))
+            for column in cls.__table__.columns.keys()
+            if column != cls.primary_key() or column in data)
+        return _write_by_key(cls, key, lambda query: query.update(
+            values, synchronize_session=False))
+
     resource = retrieve_resource(collection, key)
 
-    _validate(endpoint_class(collection), request.method, resource)
+    _validate(cls, request.method, resource)
 
     resource.replace(get_resource_data(request))
     try:
@@ -434,18 +1880,155 @@ def put_resource(collection, key):
     return no_content_response()
 
 
+def _ndjson_items(stream):
+    """Yield the object on each line of the newline-delimited JSON *stream*.
+
+    :param stream: the body of the request
+    :rtype: generator
+
+    """
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line.decode('utf-8'))
+        except ValueError:
+            raise InvalidAPIUsage(400, INVALID_LINE_MESSAGE.format(number))
+
+
+def _bulk_create(cls, items):
+    """Insert a resource of type *cls* for each dictionary in *items*, in a
+    single transaction, and return the result for each item.
+
+    Each resource must pass the ``validate_POST`` hook of *cls*; the
+    results of those that don't record why, and they are left out. The rest
+    are inserted ``SANDMAN_BULK_CHUNK_SIZE`` (1000 by default) at a time with
+    the table's ``INSERT`` rather than through the session, so that memory
+    use doesn't grow with the number of items. The items of a chunk which
+    give their primary key are inserted with one ``executemany`` for each
+    set of columns they give. The keys the database generates aren't
+    returned by ``executemany``, so the other items are inserted with a
+    single multi-row ``INSERT ... RETURNING`` on PostgreSQL, and one at a
+    time elsewhere, so that the result of every item has its URI.
+
+    :param cls: class associated with the request's endpoint
+    :param items: iterable of dictionaries of column values
+    :rtype: list
+
+    """
+    session = _get_session()
+    chunk_size = app.config.get('SANDMAN_BULK_CHUNK_SIZE', 1000)
+    columns = cls.__table__.columns.keys()
+    primary_key = cls.primary_key()
+    statement = cls.__table__.insert()
+    returning = session.connection().dialect.name == 'postgresql'
+    results = []
+    chunk = []
+
+    def created(index, key):
+        """Record the URI of the resource created for the item at *index*."""
+        results[index]['self'] = '/{}/{}'.format(cls.endpoint(), key)
+
+    def insert():
+        """Insert the rows in *chunk*, grouped by the columns they give."""
+        groups = collections.OrderedDict()
+        for index, row in chunk:
+            groups.setdefault(tuple(sorted(row)), []).append((index, row))
+        for names, group in groups.items():
+            rows = [row for _, row in group]
+            if primary_key in names:
+                session.execute(statement, rows)
+                for index, row in group:
+                    created(index, row[primary_key])
+            elif returning:
+                keys = session.execute(statement.values(rows).returning(
+                    cls.__table__.columns[primary_key])).fetchall()
+                for (index, _), (key,) in zip(group, keys):
+                    created(index, key)
+            else:
+                for index, row in group:
+                    created(index, session.execute(
+                        statement, row).inserted_primary_key[0])
+        del chunk[:]
+
+    try:
+        for number, item in enumerate(items):
+            if not isinstance(item, dict):
+                results.append({
+                    'status': 400,
+                    'message': INVALID_ITEM_MESSAGE.format(number)})
+                continue
+            resource = cls()
+            resource.from_dict(item)
+            try:
+                _validate(cls, request.method, resource)
+            except InvalidAPIUsage as exception:
+                results.append(
+                    dict(exception.to_dict(), status=exception.code))
+                continue
+            row = dict((column, getattr(resource, column))
+                       for column in columns if column in item)
+            if row.get(primary_key) is None:
+                row.pop(primary_key, None)
+            chunk.append((len(results), row))
+            results.append({'status': 201})
+            if len(chunk) >= chunk_size:
+                insert()
+        insert()
+        _commit(session)
+    except IntegrityError as exception:
+        session.rollback()
+        raise InvalidAPIUsage(422, FORWARDED_EXCEPTION_MESSAGE.format(
+            exception))
+    except Exception:
+        session.rollback()
+        raise
+    _bump_generation(cls.endpoint())
+    return results
+
+
+def _bulk_created_response(cls, items):
+    """Return the response to creating a resource for each of *items*: a
+    *201* if all of them were created, or a *207* if some were not. The body
+    lists the result of each item in order, each with its ``status`` and
+    either the URI of the created resource or why it wasn't created.
+
+    :param cls: class associated with the request's endpoint
+    :param items: iterable of dictionaries of column values
+    :rtype: :class:`flask.Response`
+
+    """
+    results = _bulk_create(cls, items)
+    response = jsonify({'results': results})
+    if all(result['status'] == 201 for result in results):
+        response.status_code = 201
+    else:
+        response.status_code = 207
+    return response
+
+
 @app.route('/<collection>', methods=['POST'])
 def post_resource(collection):
     """Return the appropriate *Response* based on adding a new resource to
     *collection*.
 
+    If the request's body is a JSON array (or newline-delimited JSON), a
+    resource is added for each of its objects, as described in
+    :func:`_bulk_create`.
+
     :param string collection: a :class:`sandman.model.Model` endpoint
     :rtype: :class:`flask.Response`
 
     """
     cls = endpoint_class(collection)
+    content_type = request.headers.get('Content-type', '').split(';')[0]
+    if content_type in NDJSON_CONTENT_TYPES:
+        return _bulk_created_response(cls, _ndjson_items(request.stream))
+    data = get_resource_data(request)
+    if isinstance(data, list):
+        return _bulk_created_response(cls, data)
     resource = cls()
-    resource.from_dict(get_resource_data(request))
+    resource.from_dict(data)
 
     _validate(cls, request.method, resource)
 
@@ -464,7 +2047,14 @@ def delete_resource(collection, key):
 
     """
     cls = endpoint_class(collection)
-    resource = cls()
+    # Deleting through the session lets the relationships of the tables
+    # referring to this one refuse to orphan their rows
+    if not hasattr(cls, 'validate_' + request.method) and not _is_referenced(
+            cls):
+        _validate(cls, request.method)
+        return _write_by_key(cls, key, lambda query: query.delete(
+            synchronize_session=False))
+
     resource = retrieve_resource(collection, key)
 
     _validate(cls, request.method, resource)
@@ -477,8 +2067,134 @@ def delete_resource(collection, key):
     return no_content_response()
 
 
+def _filtered_collection_query(cls):
+    """Return a query for the resources of *cls* matching the current
+    request's filters, having checked the request may write to them.
+
+    Writing to a whole collection at once is refused: the request must have
+    at least one filter. If *cls* has a validator for the request's method,
+    it is given the list of matching resources, as for a ``GET`` of the
+    collection; otherwise they aren't loaded at all.
+
+    :param cls: class associated with the request's endpoint
+    :rtype: :class:`sqlalchemy.orm.Query`
+
+    """
+    params = {}
+    criteria = _collection_filters(cls, request.args, params)
+    if not criteria:
+        raise InvalidAPIUsage(400, MISSING_FILTER_MESSAGE.format(
+            request.method, cls.endpoint()))
+    query = _get_session().query(cls).filter(*criteria).params(params)
+    if hasattr(cls, 'validate_' + request.method):
+        _validate(cls, request.method, query.all())
+    else:
+        _validate(cls, request.method)
+    return query
+
+
+def _is_referenced(cls):
+    """Return ``True`` if the table of any registered class has a foreign key
+    referring to the table of *cls*.
+
+    :param cls: class associated with the request's endpoint
+    :rtype: bool
+
+    """
+    table = cls.__table__
+    for other in set(current_app.class_references.values()):
+        for foreign_key in other.__table__.foreign_keys:
+            if foreign_key.column.table.name == table.name:
+                return True
+    return False
+
+
+def _affected_response(cls, write):
+    """Commit the set-based *write* to the resources of *cls* and return a
+    response giving the number of rows it affected.
+
+    :param cls: class associated with the request's endpoint
+    :param write: function performing the write, returning the row count
+    :rtype: :class:`flask.Response`
+
+    """
+    session = _get_session()
+    try:
+        affected = write()
+        _commit(session)
+    except IntegrityError as exception:
+        session.rollback()
+        raise InvalidAPIUsage(422, FORWARDED_EXCEPTION_MESSAGE.format(
+            exception))
+    _bump_generation(cls.endpoint(), ALL_RESOURCES)
+    return jsonify({'affected': affected})
+
+
+@app.route('/<collection>', methods=['PATCH'])
+def patch_collection(collection):
+    """Update every resource in *collection* matching the request's filters
+    with the data sent in the request, in a single ``UPDATE`` statement,
+    and return the number of resources updated.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :rtype: :class:`flask.Response`
+
+    """
+    cls = endpoint_class(collection)
+    data = get_resource_data(request)
+    if request.mimetype in JSON_PATCH_CONTENT_TYPES:
+        # Operations reading the resource can't apply to many at once
+        if _json_patch_reads(data):
+            raise InvalidAPIUsage(400)
+        data = _json_patch_values(cls, data)
+    if not isinstance(data, dict) or not data:
+        raise InvalidAPIUsage(400)
+    values = dict(
+        (getattr(cls, _get_column_name(cls, name)),
+         _coerce_value(cls, name, value)) for name, value in data.items())
+    query = _filtered_collection_query(cls)
+    return _affected_response(
+        cls, lambda: query.update(values, synchronize_session=False))
+
+
+@app.route('/<collection>', methods=['DELETE'])
+def delete_collection(collection):
+    """Delete every resource in *collection* matching the request's filters
+    in a single ``DELETE`` statement, and return the number of resources
+    deleted.
+
+    If another registered table refers to *collection*'s, the resources are
+    loaded and deleted through the session instead, so that the
+    relationships of the tables referring to it refuse to orphan their rows.
+
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :rtype: :class:`flask.Response`
+
+    """
+    cls = endpoint_class(collection)
+    query = _filtered_collection_query(cls)
+    if not _is_referenced(cls):
+        return _affected_response(
+            cls, lambda: query.delete(synchronize_session=False))
+
+    def delete():
+        """Delete each resource, and return how many there were."""
+        session = _get_session()
+        resources = query.all()
+        for resource in resources:
+            session.delete(resource)
+        session.flush()
+        return len(resources)
+    return _affected_response(cls, delete)
+
+
 @app.route('/<collection>/<key>', methods=['GET'])
+@vary('Accept')
+@cache_policy(_cache_directives)
 @etag
+@last_modified(_last_modified)
+@generation_etag(_get_acceptable_response_type)
+@cache_response(_get_acceptable_response_type)
 def get_resource(collection, key):
     """Return the appropriate *Response* for retrieving a single resource.
 
@@ -487,14 +2203,32 @@ def get_resource(collection, key):
     :rtype: :class:`flask.Response`
 
     """
-    resource = retrieve_resource(collection, key)
-    _validate(endpoint_class(collection), request.method, resource)
+    cls = endpoint_class(collection)
+    resource = retrieve_resource(
+        collection, key, _get_fields(cls, request.args))
+    _validate(cls, request.method, resource)
 
     return resource_response(resource)
 
 
-@app.route('/<collection>/<key>/<attribute>', methods=['GET'])
+class _AttributeCollectionConverter(BaseConverter):
+    """Matches the collection of a request for a resource's attribute, which
+    has as many parts as the path of a static file, unless it is the static
+    folder itself (whose files would otherwise never be served)."""
+    regex = '(?!{}/)[^/]+'.format(re.escape(app.static_url_path.strip('/')))
+
+
+app.url_map.converters['attribute_collection'] = _AttributeCollectionConverter
+
+
+@app.route('/<attribute_collection:collection>/<key>/<attribute>',
+           methods=['GET'])
+@vary('Accept')
+@cache_policy(_cache_directives)
 @etag
+@last_modified(_last_modified)
+@generation_etag(_get_acceptable_response_type)
+@cache_response(_get_acceptable_response_type)
 def get_resource_attribute(collection, key, attribute):
     """Return the appropriate *Response* for retrieving an attribute of
     a single resource.
@@ -504,8 +2238,12 @@ def get_resource_attribute(collection, key, attribute):
     :rtype: :class:`flask.Response`
 
     """
-    resource = retrieve_resource(collection, key)
-    _validate(endpoint_class(collection), request.method, resource)
+    cls = endpoint_class(collection)
+    fields = None
+    if attribute in cls.__table__.columns.keys():
+        fields = [attribute]
+    resource = retrieve_resource(collection, key, fields)
+    _validate(cls, request.method, resource)
     value = getattr(resource, attribute)
     if isinstance(value, Model):
         return resource_response(value)
@@ -513,8 +2251,107 @@ def get_resource_attribute(collection, key, attribute):
         return attribute_response(resource, attribute, value)
 
 
+def _should_stream(cls, response_type):
+    """Return ``True`` if the collection requested should be streamed from
+    the database rather than loaded in full before being rendered.
+
+    Newline-delimited JSON and CSV responses are always streamed; JSON
+    responses are streamed if the ``SANDMAN_STREAM_COLLECTIONS`` config value
+    is set. Only unpaginated, unexpanded responses are streamed. Since a
+    ``validate_GET`` hook expects the whole collection, classes defining one
+    are never streamed.
+
+    :param cls: class associated with the request's endpoint
+    :param int response_type: the negotiated response type
+    :rtype: bool
+
+    """
+    if response_type == JSON:
+        enabled = app.config.get('SANDMAN_STREAM_COLLECTIONS', False)
+    else:
+        enabled = response_type in (NDJSON, CSV)
+    return bool(
+        enabled and
+        'page' not in request.args and
+        'after' not in request.args and
+        'expand' not in request.args and
+        not hasattr(cls, 'validate_GET'))
+
+
+def _total_count(cls, collection, query_arguments):
+    """Return the ``(count, precision)`` of the resources in *collection*
+    matching the filters in *query_arguments*, or ``None`` if *cls* doesn't
+    report counts for such a request.
+
+    Unfiltered collections are counted according to the Model's
+    :attr:`__total_count__`; filtered collections are counted exactly, and
+    only if its :attr:`__count_filtered__` is set. Counts are cached for
+    ``SANDMAN_COUNT_TTL`` seconds.
+
+    :param cls: class associated with the request's endpoint
+    :param string collection: a :class:`sandman.model.Model` endpoint
+    :param dict query_arguments: query arguments of the current request
+    :rtype: tuple or None
+
+    """
+    query_arguments = query_arguments or {}
+    filter_arguments = tuple(sorted(
+        (key, value) for key, value in query_arguments.items() if
+        key not in COLLECTION_ARGUMENTS))
+    if filter_arguments:
+        if not cls.__count_filtered__:
+            return None
+        precision = 'exact'
+    else:
+        precision = cls.__total_count__
+        if precision is None:
+            return None
+    count_cache = _get_count_cache()
+    key = (collection, precision, filter_arguments)
+    total = count_cache.get(key)
+    if total is None:
+        count = None
+        if precision == 'estimate':
+            count = estimate_row_count(db.engine, cls.__table__)
+        if count is None:
+            precision = 'exact'
+            params = {}
+            count = _get_session().query(
+                func.count(getattr(cls, cls.primary_key()))).filter(
+                    *_collection_filters(cls, query_arguments, params)).params(
+                        params).scalar()
+        total = (count, precision)
+        count_cache.set(key, total, app.config.get('SANDMAN_COUNT_TTL', 60))
+    return total
+
+
+def _add_count_headers(response, total, start=None, count=None):
+    """Add the ``X-Total-Count`` (and, for a range of *count* resources
+    starting at *start*, ``Content-Range``) headers to *response*.
+
+    :param response: response for a collection
+    :type response: :class:`flask.Response`
+    :param tuple total: ``(count, precision)`` from :func:`_total_count`
+    :param int start: offset of the first resource in the response
+    :param int count: number of resources in the response
+
+    """
+    total_count, precision = total
+    response.headers['X-Total-Count'] = str(total_count)
+    response.headers['X-Total-Count-Precision'] = precision
+    if start is not None and count:
+        response.headers['Content-Range'] = 'resources {}-{}/{}'.format(
+            start, start + count - 1, total_count)
+    return response
+
+
 @app.route('/<collection>', methods=['GET'])
+@vary('Accept')
+@cache_policy(_cache_directives)
 @etag
+@last_modified(_last_modified)
+@generation_etag(_get_collection_response_type)
+@cache_response(_get_collection_response_type)
 def get_collection(collection):
     """Return the appropriate *Response* for retrieving a collection of
     resources.
@@ -527,26 +2364,60 @@ def get_collection(collection):
     cls = endpoint_class(collection)
 
     resources = retrieve_collection(collection, request.args)
+    response_type = _get_collection_response_type()
+    if _should_stream(cls, response_type):
+        _validate(cls, request.method)
+        resources = _stream_collection(resources)
+        fields = _get_fields(cls, request.args)
+        if response_type == NDJSON:
+            response = _collection_ndjson_response(resources, fields=fields)
+        elif response_type == CSV:
+            response = _collection_csv_response(cls, resources, fields)
+        else:
+            response = _collection_json_stream_response(
+                cls, resources, fields=fields)
+        total = _total_count(cls, collection, request.args)
+        if total is not None:
+            _add_count_headers(response, total)
+        return response
+    resources = resources.all()
 
     _validate(cls, request.method, resources)
 
-    start = stop = None
-
-    if request.args and 'page' in request.args:
-        page = int(request.args['page'])
+    links = None
+    start = 0
+    page = _get_page(request.args)
+    if 'after' in request.args:
+        start = None
+        page_size = _get_limit(request.args)
+        if page_size is None:
+            page_size = app.config.get('RESULTS_PER_PAGE', 20)
+        has_next = len(resources) > page_size
+        resources = resources[:page_size]
+        links = _cursor_links(
+            resources, has_next, _get_cursor_sort(cls, request.args))
+    elif page is not None:
         results_per_page = app.config.get('RESULTS_PER_PAGE', 20)
-        start, stop = page * results_per_page, (page + 1) * results_per_page
-    return collection_response(cls, resources, start, stop)
+        has_next = len(resources) > results_per_page
+        resources = resources[:results_per_page]
+        links = _page_links(page, has_next)
+        start = page * results_per_page
+    response = collection_response(cls, resources, links)
+    total = _total_count(cls, collection, request.args)
+    if total is not None:
+        _add_count_headers(response, total, start, len(resources))
+    return response
 
 
 @app.route('/', methods=['GET'])
+@vary('Accept')
+@cache_policy(_cache_directives)
 @etag
+@cache_response(_get_acceptable_response_type)
 def index():
     """Return information about each type of resource and how it can be
     accessed."""
-    classes = []
-    with app.app_context():
-        classes = set(current_app.class_references.values())
+    classes = set(current_app.class_references.values())
     if _get_acceptable_response_type() == JSON:
         meta_data = {}
         for cls in classes:
@@ -560,7 +2431,9 @@ def index():
 
 
 @app.route('/<collection>/meta', methods=['GET'])
+@cache_policy(_cache_directives)
 @etag
+@cache_response()
 def get_meta(collection):
     """Return the meta-description of a given resource.
 
@@ -571,3 +2444,192 @@ def get_meta(collection):
     cls = endpoint_class(collection)
     description = cls.meta()
     return jsonify(description)
+
+
+def _compressed_static_file(filename, encoding):
+    """Return the static file *filename* compressed with *encoding*.
+
+    Static files are compressed once (at the slowest, smallest level) and
+    kept in memory until they change.
+
+    :param string filename: path of the file in the static folder
+    :param string encoding: content coding to compress it with
+    :rtype: bytes
+
+    """
+    path = safe_join(app.static_folder, filename)
+    cache_key = (path, os.path.getmtime(path), encoding)
+    static_compression_cache = _get_static_compression_cache()
+    body = static_compression_cache.get(cache_key)
+    if body is None:
+        with open(path, 'rb') as static_file:
+            body = compress(
+                static_file.read(), encoding, MAX_LEVELS[encoding])
+        static_compression_cache.set(cache_key, body)
+    return body
+
+
+@app.after_request
+def compress_response(response):
+    """Compress *response* with the best content coding the client accepts.
+
+    Only ``200`` responses of a compressible type are compressed, and only if
+    they are streamed or at least ``SANDMAN_COMPRESSION_MIN_SIZE`` bytes (1024
+    by default) long. Compressing a body changes it, so a strong ETag
+    computed from the uncompressed body is made weak. Setting
+    ``SANDMAN_COMPRESSION`` to ``False`` disables compression (e.g. if a
+    reverse proxy already does it).
+
+    :param response: the response to the current request
+    :type response: :class:`flask.Response`
+    :rtype: :class:`flask.Response`
+
+    """
+    if (not app.config.get('SANDMAN_COMPRESSION', True) or
+            response.status_code != 200 or
+            'Content-Encoding' in response.headers or
+            not is_compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    min_size = app.config.get('SANDMAN_COMPRESSION_MIN_SIZE', 1024)
+    if request.endpoint == 'static':
+        filename = request.view_args['filename']
+        if os.path.getsize(safe_join(app.static_folder, filename)) < min_size:
+            return response
+        response.direct_passthrough = False
+        response.set_data(_compressed_static_file(filename, encoding))
+    elif response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        compressed_bodies = getattr(response, 'compressed_bodies', None)
+        body = None
+        if compressed_bodies is not None:
+            body = compressed_bodies.get(encoding)
+        if body is None:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            body = compress(data, encoding)
+            if compressed_bodies is not None:
+                compressed_bodies[encoding] = body
+        response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + etag
+    return response
+
+
+@event.listens_for(mapper, 'load')
+def _keep_batch_resource(resource, _):
+    """Keep each resource loaded during a batch until the batch ends.
+
+    The session's identity map only holds resources weakly, so a resource
+    would otherwise be gone by the time a later sub-request looks it up.
+
+    """
+    if has_app_context():
+        resources = getattr(g, 'batch_resources', None)
+        if resources is not None:
+            resources.append(resource)
+
+
+def _dispatch_batch_request(entry):
+    """Dispatch the sub-request described by *entry* through the view
+    functions, as part of the current batch, and return its result.
+
+    The sub-request shares the batch's application context, and so its
+    session and identity map. It is sent with the batch's ``Authorization``
+    header, ``Accept: application/json`` unless *entry* has headers of its
+    own, and the JSON encoding of the entry's ``body``. An
+    ``Accept-Encoding`` header of the entry is dropped, since its body is
+    decoded into the batch's response.
+
+    :param dict entry: ``method``, ``path`` and, optionally, ``body`` and
+        ``headers`` of the sub-request
+    :rtype: dict
+
+    """
+    if (not isinstance(entry, dict) or 'path' not in entry or
+            entry['path'].split('?')[0].rstrip('/') == '/_batch'):
+        raise InvalidAPIUsage(400, INVALID_BATCH_MESSAGE.format(entry))
+    headers = {'Accept': 'application/json'}
+    if 'Authorization' in request.headers:
+        headers['Authorization'] = request.headers['Authorization']
+    headers.update(
+        (name, value) for name, value in (entry.get('headers') or {}).items()
+        if name.lower() != 'accept-encoding')
+    data = None
+    if entry.get('body') is not None:
+        data = json.dumps(entry['body'])
+    with app.test_request_context(
+            entry['path'],
+            method=entry.get('method', 'GET').upper(),
+            headers=headers,
+            data=data,
+            content_type='application/json'):
+        response = app.full_dispatch_request()
+        body = response.get_data(as_text=True)
+        if response.mimetype == 'application/json' and body:
+            body = json.loads(body)
+        result = {'status': response.status_code, 'body': body}
+        if 'Location' in response.headers:
+            result['location'] = response.headers['Location']
+        return result
+
+
+@app.route('/_batch', methods=['POST'])
+def batch():
+    """Run each of the sub-requests in the request's body through the
+    view functions and return all of their results in one response.
+
+    The body is a list of ``{"method": ..., "path": ..., "body": ...}``
+    objects, or an object with such a list as its ``requests`` and a
+    ``transaction`` flag. Sub-requests share one session, so resources
+    loaded by one are found in the identity map by the next. Without a
+    transaction, each write is committed as usual, and a failed sub-request
+    doesn't stop the following ones. With one, nothing is committed until
+    every sub-request has succeeded; the first failure rolls back all of
+    them and ends the batch, with that failure's status.
+
+    :rtype: :class:`flask.Response`
+
+    """
+    data = request.get_json(force=True, silent=True)
+    transaction = False
+    if isinstance(data, dict):
+        transaction = bool(data.get('transaction', False))
+        data = data.get('requests')
+    if not isinstance(data, list):
+        raise InvalidAPIUsage(400, INVALID_BATCH_MESSAGE.format(data))
+
+    session = _get_session()
+    status_code = 200
+    results = []
+    g.batch_resources = []
+    if transaction:
+        g.batch_writes = []
+    try:
+        for entry in data:
+            result = _dispatch_batch_request(entry)
+            results.append(result)
+            if result['status'] >= 400:
+                session.rollback()
+                if transaction:
+                    status_code = result['status']
+                    break
+        else:
+            if transaction:
+                session.commit()
+                for collection, key in g.batch_writes:
+                    _get_generations().bump(collection, key)
+    finally:
+        g.batch_writes = g.batch_resources = None
+    response = jsonify({'results': results})
+    response.status_code = status_code
+    return response
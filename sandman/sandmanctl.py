@@ -3,8 +3,9 @@ from __future__ import absolute_import
 
 import click
 
-from sandman import app
+from sandman import app, db
 from sandman.model import activate
+from sandman.model.utils import refresh_snapshot as save_snapshot
 
 def print_version(ctx, value):
     """Print the current version of sandman and exit."""
@@ -29,13 +30,24 @@ def print_version(ctx, value):
         help='Hostname sandman should bind to')
 @click.option('--port', default=8080,
         help='Port sandman should bind to')
+@click.option('--snapshot', default=None,
+        help='Load the reflected schema from (and save it to) this file')
+@click.option('--refresh-snapshot', default=None,
+        help='Reflect the database into this snapshot file and exit')
 @click.option('--version', is_flag=True,
         callback=print_version, expose_value=False, is_eager=True)
 @click.argument('URI', metavar='<URI>')
-def run(generate_pks, show_pks, host, port, uri):
+#pylint: disable=too-many-arguments
+def run(generate_pks, show_pks, host, port, snapshot, refresh_snapshot,
+        uri):
     """Connect sandman to <URI> and start the API server/admin
     interface."""
     app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    if refresh_snapshot is not None:
+        with app.app_context():
+            save_snapshot(db, refresh_snapshot)
+        return
+    app.config['SANDMAN_REFLECTION_SNAPSHOT'] = snapshot
     app.config['SANDMAN_GENERATE_PKS'] = generate_pks
     app.config['SANDMAN_SHOW_PKS'] = show_pks
     app.config['SERVER_HOST'] = host
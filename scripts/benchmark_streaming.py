@@ -0,0 +1,80 @@
+"""Compare buffered and streamed collection responses.
+
+Builds a SQLite database with a single wide table, then GETs the whole
+collection once with ``SANDMAN_STREAM_COLLECTIONS`` disabled and once with it
+enabled, each in a fresh process. Reports time-to-first-byte, total time and
+peak RSS for both.
+
+Usage: python scripts/benchmark_streaming.py [number of rows]
+"""
+from __future__ import print_function
+
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+DB_LOCATION = os.path.join(tempfile.gettempdir(), 'sandman_benchmark.sqlite3')
+
+
+def build_database(rows):
+    """Create a table with *rows* rows at DB_LOCATION."""
+    if os.path.exists(DB_LOCATION):
+        os.unlink(DB_LOCATION)
+    connection = sqlite3.connect(DB_LOCATION)
+    connection.execute(
+        'CREATE TABLE reading (id INTEGER PRIMARY KEY, sensor VARCHAR, '
+        'value FLOAT, notes TEXT)')
+    connection.executemany(
+        'INSERT INTO reading (sensor, value, notes) VALUES (?, ?, ?)',
+        (('sensor-{}'.format(i % 100), i * 0.5, 'x' * 200)
+         for i in range(rows)))
+    connection.commit()
+    connection.close()
+
+
+def measure(stream):
+    """GET the collection and print 'ttfb total maxrss' for this process."""
+    from sandman import app
+    from sandman.model import activate
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + DB_LOCATION
+    app.config['SANDMAN_STREAM_COLLECTIONS'] = stream
+    activate(admin=False, browser=False)
+    client = app.test_client()
+
+    start = time.time()
+    response = client.get('/readings', buffered=False)
+    chunks = iter(response.response)
+    size = len(next(chunks))
+    first_byte = time.time()
+    for chunk in chunks:
+        size += len(chunk)
+    end = time.time()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(first_byte - start, end - start, max_rss, size)
+
+
+def main():
+    """Build the database and run each mode in its own process."""
+    if len(sys.argv) > 2 and sys.argv[1] == '--measure':
+        measure(sys.argv[2] == 'stream')
+        return
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    build_database(rows)
+    print('{} rows'.format(rows))
+    print('{:<10} {:>10} {:>10} {:>14}'.format(
+        'mode', 'ttfb (s)', 'total (s)', 'max rss (KiB)'))
+    for mode in ('buffered', 'stream'):
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--measure', mode])
+        ttfb, total, max_rss, _ = output.decode('utf-8').split()
+        print('{:<10} {:>10.3f} {:>10.3f} {:>14}'.format(
+            mode, float(ttfb), float(total), max_rss))
+    os.unlink(DB_LOCATION)
+
+
+if __name__ == '__main__':
+    main()
@@ -80,5 +80,7 @@ setup(
         ],
     extras_require={
         'testing': ['pytest'],
+        'brotli': ['brotli'],
+        'zstd': ['zstandard'],
       }
 )
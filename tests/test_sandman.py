@@ -4,8 +4,36 @@ import os
 import shutil
 import json
 import datetime
-
-from sandman import app
+import multiprocessing
+import threading
+import zlib
+
+from sqlalchemy import MetaData, event
+
+from sandman import app, db
+from sandman.model.snapshot import ReflectionSnapshot
+from sandman.model import activate
+from sandman.model.utils import _prepare_lazy_reflection
+
+def _worker(method, uri, data, count=1):
+    """Send *count* requests from a separate worker process, exiting with a
+    non-zero status if any of them fails."""
+    client = app.test_client()
+    for _ in range(count):
+        response = client.open(uri, method=method,
+                content_type='application/json', data=json.dumps(data))
+        assert response.status_code in (201, 204)
+
+def _run_workers(*workers):
+    """Run each ``(method, uri, data, count)`` tuple in *workers* in its own
+    process and return their exit codes."""
+    processes = [multiprocessing.Process(target=_worker, args=args)
+            for args in workers]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
 
 class TestSandmanBase(object):
     """Base class for all sandman test classes."""
@@ -126,6 +154,18 @@ class TestSandmanBasicVerbs(TestSandmanBase):
         response = self.get_response('/tracks/1', 200, params={'expand': 1})
         assert 'album' in json.loads(response.get_data(as_text=True))
 
+    def test_get_expanded_resource_paths(self):
+        """Can we expand nested related resources by path?"""
+        response = self.get_response('/tracks/1', 200,
+                params={'expand': 'album,album.artist'})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert as_json['album']['artist']['Name'] == 'AC/DC'
+        assert 'genre_url' not in as_json['album']
+
+    def test_get_expanded_unknown_path(self):
+        """Is expanding a related resource that doesn't exist rejected?"""
+        self.get_response('/tracks/1', 400, params={'expand': 'album.foo'})
+
     def test_get_etag_header(self):
         """Does GETing a resource with the ETag header return a 304?"""
         response = self.get_response('/tracks/1', 200)
@@ -326,6 +366,1187 @@ class TestSandmanValidation(TestSandmanBase):
         response = self.get_response('/artists', 200, params={'page': 2})
         assert len(json.loads(response.get_data(as_text=True))['resources']) == 20
 
+    def test_pagination_links(self):
+        """Do paginated results link to the previous and next pages?"""
+        response = self.get_response('/artists', 200, params={'page': 2})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert as_json['resources'][0]['ArtistId'] == 41
+        assert {'rel': 'prev', 'uri': '/artists?page=1'} in as_json['links']
+        assert {'rel': 'next', 'uri': '/artists?page=3'} in as_json['links']
+        assert 'rel="next"' in response.headers['Link']
+
+    def test_pagination_last_page(self):
+        """Does the last page of a collection omit the 'next' link?"""
+        response = self.get_response('/artists', 200, params={'page': 13})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert len(as_json['resources']) == 15
+        assert [link['rel'] for link in as_json['links']] == ['prev']
+
+    def test_cursor_pagination(self):
+        """Can we walk an entire collection using cursors?"""
+        response = self.get_response('/artists', 200,
+                params={'after': '', 'limit': 100})
+        as_json = json.loads(response.get_data(as_text=True))
+        seen = [resource['ArtistId'] for resource in as_json['resources']]
+        while as_json.get('links'):
+            response = self.get_response(as_json['links'][0]['uri'], 200)
+            as_json = json.loads(response.get_data(as_text=True))
+            seen += [resource['ArtistId'] for resource in as_json['resources']]
+        assert seen == list(range(1, 276))
+
+    def test_cursor_pagination_with_sort(self):
+        """Do cursors respect the requested sort column?"""
+        response = self.get_response('/artists', 200,
+                params={'after': '', 'limit': 2, 'sort': 'Name'})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert as_json['resources'][0]['Name'] == 'A Cor Do Som'
+        response = self.get_response(as_json['links'][0]['uri'], 200)
+        as_json = json.loads(response.get_data(as_text=True))
+        assert as_json['resources'][0]['Name'] == 'Aaron Copland & London Symphony Orchestra'
+
+    def test_cursor_pagination_with_nulls(self):
+        """Can we walk an entire collection using cursors when the sort
+        column has NULLs?"""
+        for sort in ('Composer', '-Composer'):
+            response = self.get_response('/tracks', 200,
+                    params={'after': '', 'limit': 500, 'sort': sort})
+            as_json = json.loads(response.get_data(as_text=True))
+            seen = [resource['TrackId'] for resource in as_json['resources']]
+            while as_json.get('links'):
+                response = self.get_response(as_json['links'][0]['uri'], 200)
+                as_json = json.loads(response.get_data(as_text=True))
+                seen += [
+                    resource['TrackId'] for resource in as_json['resources']]
+            assert sorted(seen) == list(range(1, 3504))
+
+    def test_invalid_cursor(self):
+        """Is a malformed cursor rejected?"""
+        self.get_response('/artists', 400, params={'after': 'foo'})
+
+    def test_invalid_page(self):
+        """Is a non-numeric page rejected?"""
+        self.get_response('/artists', 400, params={'page': 'foo'})
+
+class TestSandmanFilters(TestSandmanBase):
+    """Sandman tests related to filtering collections"""
+
+    def get_count(self, params):
+        """Return the number of resources returned for filter *params*."""
+        response = self.get_response('/tracks', 200, params=params)
+        return len(json.loads(response.get_data(as_text=True))[u'resources'])
+
+    def test_greater_than_filter(self):
+        """Test filtering with the 'gt' operator."""
+        assert self.get_count({'Milliseconds__gt': '1000000'}) == 215
+
+    def test_between_filter(self):
+        """Test filtering with the 'between' operator."""
+        assert self.get_count(
+            {'Milliseconds__between': '200000,300000'}) == 1680
+
+    def test_in_filter(self):
+        """Test filtering with the 'in' operator."""
+        assert self.get_count({'TrackId__in': '1,2,3'}) == 3
+
+    def test_isnull_filter(self):
+        """Test filtering with the 'isnull' operator."""
+        assert self.get_count({'Composer__isnull': 'true'}) == 978
+
+    def test_startswith_filter(self):
+        """Test filtering with the 'startswith' operator."""
+        assert self.get_count({'Name__startswith': 'Love'}) == 27
+
+    def test_descending_sort(self):
+        """Test sorting a collection in descending order."""
+        response = self.get_response('/tracks', 200,
+                params={'sort': '-Milliseconds', 'limit': 1})
+        assert json.loads(response.get_data(as_text=True))[u'resources'][0][
+            u'Name'] == u'Occupation / Precipice'
+
+    def test_unknown_column_filter(self):
+        """Is filtering on a column that doesn't exist rejected?"""
+        self.get_response('/tracks', 400, params={'Foo': 'bar'})
+
+    def test_unknown_operator(self):
+        """Is filtering with an unknown operator rejected?"""
+        self.get_response('/tracks', 400, params={'Milliseconds__foo': '1'})
+
+    def test_invalid_value(self):
+        """Is a value that can't be converted to the column's type rejected?"""
+        self.get_response('/tracks', 400, params={'Milliseconds__gt': 'foo'})
+
+class TestSandmanQueryCache(TestSandmanBase):
+    """Sandman tests related to the compiled query cache"""
+
+    def setup_method(self, args):
+        super(TestSandmanQueryCache, self).setup_method(args)
+        app.query_cache = None
+
+    def test_same_shape_reuses_statement(self):
+        """Do queries differing only in their values share a statement?"""
+        self.get_response('/artists', 200, params={'Name': 'AC/DC'})
+        hits = app.query_cache.stats()['hits']
+        response = self.get_response('/artists', 200,
+                params={'Name': 'Aerosmith'})
+        resources = json.loads(response.get_data(as_text=True))[u'resources']
+        assert [resource[u'ArtistId'] for resource in resources] == [3]
+        assert app.query_cache.stats()['hits'] == hits + 1
+
+    def test_different_shape_not_shared(self):
+        """Do queries with different operators get their own statements?"""
+        self.get_response('/tracks', 200, params={'TrackId__in': '1,2'})
+        misses = app.query_cache.stats()['misses']
+        response = self.get_response('/tracks', 200,
+                params={'TrackId__in': '1,2,3'})
+        assert len(json.loads(
+            response.get_data(as_text=True))[u'resources']) == 3
+        assert app.query_cache.stats()['misses'] == misses + 1
+
+class TestSandmanFields(TestSandmanBase):
+    """Sandman tests related to sparse fieldsets"""
+
+    def test_collection_fields(self):
+        """Are only the requested fields of a collection returned?"""
+        response = self.get_response('/tracks', 200,
+                params={'page': 0, 'fields': 'Name,AlbumId'})
+        resource = json.loads(response.get_data(as_text=True))['resources'][0]
+        assert resource['Name'] == 'For Those About To Rock (We Salute You)'
+        assert resource['AlbumId'] == 1
+        assert 'Composer' not in resource
+        assert resource['self'] == '/tracks/1'
+
+    def test_resource_fields(self):
+        """Are only the requested fields of a resource returned?"""
+        response = self.get_response('/artists/1', 200,
+                params={'fields': 'Name'})
+        assert json.loads(response.get_data(as_text=True))['Name'] == 'AC/DC'
+
+    def test_unknown_field(self):
+        """Is requesting a field that doesn't exist rejected?"""
+        self.get_response('/tracks', 400, params={'fields': 'Foo'})
+
+    def test_html_collection_fields(self):
+        """Are only the requested fields shown in the HTML collection?"""
+        response = self.get_response('/tracks', 200,
+                params={'page': 0, 'fields': 'Name'},
+                headers={'Accept': 'text/html'})
+        assert 'Composer' not in response.get_data(as_text=True)
+
+class TestSandmanStreaming(TestSandmanBase):
+    """Sandman tests related to streaming collection responses"""
+
+    def setup_method(self, args):
+        super(TestSandmanStreaming, self).setup_method(args)
+        app.config['SANDMAN_STREAM_COLLECTIONS'] = True
+
+    def teardown_method(self, args):
+        super(TestSandmanStreaming, self).teardown_method(args)
+        app.config['SANDMAN_STREAM_COLLECTIONS'] = False
+
+    def test_streamed_collection(self):
+        """Is a streamed collection identical to a buffered one?"""
+        response = self.get_response('/artists', 200)
+        assert 'ETag' not in response.headers
+        as_json = json.loads(response.get_data(as_text=True))
+        assert len(as_json[u'resources']) == 275
+        assert as_json[u'resources'][0][u'Name'] == u'AC/DC'
+
+    def test_streamed_collection_top_level_json_name(self):
+        """Does a streamed collection use the Model's top level json name?"""
+        response = self.get_response('/albums', 200)
+        assert len(json.loads(response.get_data(as_text=True))[u'Albums']) == 347
+
+    def test_paginated_collection_not_streamed(self):
+        """Are paginated collections still buffered (and given an ETag)?"""
+        response = self.get_response('/artists', 200, params={'page': 1})
+        assert 'ETag' in response.headers
+
+class TestSandmanTotalCount(TestSandmanBase):
+    """Sandman tests related to collection total counts"""
+
+    def setup_method(self, args):
+        super(TestSandmanTotalCount, self).setup_method(args)
+        from .models import Artist
+        Artist.__total_count__ = 'exact'
+        Artist.__count_filtered__ = True
+        if getattr(app, 'count_cache', None) is not None:
+            app.count_cache.clear()
+
+    def teardown_method(self, args):
+        from .models import Artist
+        Artist.__total_count__ = None
+        Artist.__count_filtered__ = False
+        super(TestSandmanTotalCount, self).teardown_method(args)
+
+    def test_total_count(self):
+        """Does a collection report its total count?"""
+        response = self.get_response('/artists', 200)
+        assert response.headers['X-Total-Count'] == '275'
+        assert response.headers['X-Total-Count-Precision'] == 'exact'
+        assert response.headers['Content-Range'] == 'resources 0-274/275'
+
+    def test_paginated_content_range(self):
+        """Does a page of a collection report its range?"""
+        response = self.get_response('/artists', 200, params={'page': 2})
+        assert response.headers['X-Total-Count'] == '275'
+        assert response.headers['Content-Range'] == 'resources 40-59/275'
+
+    def test_filtered_total_count(self):
+        """Is the count of a filtered collection restricted to its filters?"""
+        response = self.get_response('/artists', 200,
+                params={'ArtistId__lte': '10'})
+        assert response.headers['X-Total-Count'] == '10'
+
+    def test_estimated_total_count(self):
+        """Does an estimate fall back to an exact count without statistics?"""
+        from .models import Artist
+        Artist.__total_count__ = 'estimate'
+        response = self.get_response('/artists', 200)
+        assert response.headers['X-Total-Count'] == '275'
+        assert response.headers['X-Total-Count-Precision'] == 'exact'
+
+    def test_no_total_count_by_default(self):
+        """Do Models omit the total count unless they ask for it?"""
+        response = self.get_response('/albums', 200)
+        assert 'X-Total-Count' not in response.headers
+
+class TestSandmanResponseCache(TestSandmanBase):
+    """Sandman tests related to the response cache"""
+
+    def setup_method(self, args):
+        super(TestSandmanResponseCache, self).setup_method(args)
+        app.config['SANDMAN_RESPONSE_CACHE_SIZE'] = 100
+        app.response_cache = None
+
+    def teardown_method(self, args):
+        app.config['SANDMAN_RESPONSE_CACHE_SIZE'] = 0
+        app.response_cache = None
+        super(TestSandmanResponseCache, self).teardown_method(args)
+
+    def test_repeated_get_cached(self):
+        """Is a repeated GET served from the cache?"""
+        first = self.get_response('/artists/1', 200)
+        second = self.get_response('/artists/1', 200)
+        assert first.get_data() == second.get_data()
+        assert app.response_cache.stats()['hits'] == 1
+
+    def test_content_type_cached_separately(self):
+        """Are responses of different content types cached separately?"""
+        self.get_response('/artists/1', 200)
+        response = self.get_response('/artists/1', 200,
+                headers={'Accept': 'text/html'})
+        assert self.is_html_response(response)
+        assert app.response_cache.stats()['hits'] == 0
+
+    def test_write_invalidates_collection(self):
+        """Does adding a resource invalidate its collection?"""
+        self.get_response('/artists', 200)
+        self.post_response()
+        response = self.get_response('/artists', 200)
+        assert len(json.loads(
+            response.get_data(as_text=True))[u'resources']) == 276
+
+    def test_write_invalidates_resource_by_key(self):
+        """Does updating a resource invalidate only that resource?"""
+        self.get_response('/artists/1', 200)
+        self.get_response('/artists/2', 200)
+        response = self.app.patch('/artists/1',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 204
+        response = self.get_response('/artists/1', 200)
+        assert json.loads(
+            response.get_data(as_text=True))[u'Name'] == u'Jeff Knupp'
+        assert app.response_cache.stats()['hits'] == 0
+        self.get_response('/artists/2', 200)
+        assert app.response_cache.stats()['hits'] == 1
+
+    def test_model_cache_ttl(self):
+        """Can a Model opt out of caching with ``__cache_ttl__``?"""
+        from .models import Artist
+        Artist.__cache_ttl__ = 0
+        try:
+            self.get_response('/artists/1', 200)
+            self.get_response('/artists/1', 200)
+        finally:
+            Artist.__cache_ttl__ = None
+        assert app.response_cache.stats()['size'] == 0
+
+    def test_expanded_not_cached(self):
+        """Does a response expanding a related resource show writes to it?"""
+        self.get_response('/albums/1', 200, params={'expand': 'artist'})
+        response = self.app.patch('/artists/1',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 204
+        response = self.get_response('/albums/1', 200,
+                params={'expand': 'artist'})
+        assert json.loads(response.get_data(as_text=True))[
+            u'artist'][u'Name'] == u'Jeff Knupp'
+
+    def test_validated_not_cached(self):
+        """Is a resource whose Model validates GETs validated every time?"""
+        self.get_response('/styles/2', 200)
+        from .models import Style
+        validate = Style.validate_GET
+        Style.validate_GET = staticmethod(lambda resource=None: False)
+        try:
+            self.get_response('/styles/2', 403)
+        finally:
+            Style.validate_GET = staticmethod(validate)
+        assert app.response_cache.stats()['size'] == 0
+
+class TestSandmanSharedInvalidation(TestSandmanBase):
+    """Sandman tests related to invalidating the response caches of several
+    worker processes"""
+
+    GENERATION_FILE = os.path.join(os.getcwd(), 'tests', 'generations.sqlite3')
+
+    def setup_method(self, args):
+        super(TestSandmanSharedInvalidation, self).setup_method(args)
+        app.config['SANDMAN_RESPONSE_CACHE_SIZE'] = 100
+        app.config['SANDMAN_CACHE_GENERATION_FILE'] = self.GENERATION_FILE
+        app.response_cache = None
+        app.generations = None
+
+    def teardown_method(self, args):
+        app.config['SANDMAN_RESPONSE_CACHE_SIZE'] = 0
+        app.config['SANDMAN_CACHE_GENERATION_FILE'] = None
+        app.response_cache = None
+        app.generations = None
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.GENERATION_FILE + suffix):
+                os.unlink(self.GENERATION_FILE + suffix)
+        super(TestSandmanSharedInvalidation, self).teardown_method(args)
+
+    def test_write_in_other_process_invalidates(self):
+        """Does a write handled by another process invalidate this one's
+        cached response?"""
+        self.get_response('/artists/1', 200)
+        assert _run_workers(
+            ('PATCH', '/artists/1', {u'Name': u'Jeff Knupp'}, 1)) == [0]
+        response = self.get_response('/artists/1', 200)
+        assert json.loads(
+            response.get_data(as_text=True))[u'Name'] == u'Jeff Knupp'
+        assert app.response_cache.stats()['hits'] == 0
+
+    def test_concurrent_workers(self):
+        """Are the writes of several concurrent processes all counted?"""
+        self.get_response('/artists', 200)
+        exit_codes = _run_workers(
+            *[('POST', '/artists', {u'Name': u'Jeff Knupp'}, 5)] * 4)
+        assert exit_codes == [0] * 4
+        assert app.response_cache.stamp('artists')[1] == 20
+        response = self.get_response('/artists', 200)
+        assert len(json.loads(
+            response.get_data(as_text=True))[u'resources']) == 295
+
+class TestSandmanGenerationETags(TestSandmanBase):
+    """Sandman tests related to ETags computed without rendering the
+    response"""
+
+    def setup_method(self, args):
+        super(TestSandmanGenerationETags, self).setup_method(args)
+        app.config['SANDMAN_GENERATION_ETAGS'] = True
+        self.statements = []
+        self.engine = db.get_engine(app)
+        event.listen(self.engine, 'before_cursor_execute', self.count)
+
+    def teardown_method(self, args):
+        event.remove(self.engine, 'before_cursor_execute', self.count)
+        app.config['SANDMAN_GENERATION_ETAGS'] = False
+        super(TestSandmanGenerationETags, self).teardown_method(args)
+
+    #pylint: disable=too-many-arguments
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        """Record each statement sent to the database."""
+        self.statements.append(statement)
+
+    def test_not_modified_without_query(self):
+        """Is a matching If-None-Match answered without querying?"""
+        response = self.get_response('/artists/1', 200)
+        etag = response.headers['ETag']
+        assert etag.startswith('W/')
+        del self.statements[:]
+        self.get_response('/artists/1', 304,
+                headers={'If-None-Match': etag}, has_data=False)
+        assert self.statements == []
+
+    def test_collection_etag_changes_on_write(self):
+        """Does a write give its collection a new ETag?"""
+        etag = self.get_response('/artists', 200).headers['ETag']
+        self.post_response()
+        response = self.get_response('/artists', 200,
+                headers={'If-None-Match': etag})
+        assert response.headers['ETag'] != etag
+
+    def test_weak_etag_fails_if_match(self):
+        """Is a weak ETag rejected by the strong comparison of If-Match?"""
+        etag = self.get_response('/artists/1', 200).headers['ETag']
+        self.get_response('/artists/1', 412,
+                headers={'If-Match': etag}, has_data=False)
+        self.get_response('/artists/1', 200, headers={'If-Match': '*'})
+
+    def test_version_column_etag(self):
+        """Is a Model's ETag derived from its ``__version_column__``?"""
+        from .models import Artist
+        app.config['SANDMAN_GENERATION_ETAGS'] = False
+        Artist.__version_column__ = 'Name'
+        try:
+            etag = self.get_response('/artists/1', 200).headers['ETag']
+            del self.statements[:]
+            self.get_response('/artists/1', 304,
+                    headers={'If-None-Match': etag}, has_data=False)
+            assert len(self.statements) == 1
+            assert 'ArtistId' not in self.statements[0].split('FROM')[0]
+        finally:
+            Artist.__version_column__ = None
+
+    def test_weak_comparison_of_body_etag(self):
+        """Does If-None-Match match a body's ETag given as weak?"""
+        app.config['SANDMAN_GENERATION_ETAGS'] = False
+        etag = self.get_response('/tracks/1', 200).headers['ETag']
+        self.get_response('/tracks/1', 304,
+                headers={'If-None-Match': 'W/' + etag}, has_data=False)
+
+class TestSandmanLastModified(TestSandmanBase):
+    """Sandman tests related to Last-Modified and If-Modified-Since"""
+
+    def setup_method(self, args):
+        super(TestSandmanLastModified, self).setup_method(args)
+        app.config['SANDMAN_TRACK_LAST_MODIFIED'] = True
+
+    def teardown_method(self, args):
+        app.config['SANDMAN_TRACK_LAST_MODIFIED'] = False
+        super(TestSandmanLastModified, self).teardown_method(args)
+
+    def test_not_modified_since(self):
+        """Is an unchanged resource answered with a 304?"""
+        response = self.get_response('/artists/1', 200)
+        modified = response.headers['Last-Modified']
+        self.get_response('/artists/1', 304,
+                headers={'If-Modified-Since': modified}, has_data=False)
+
+    def test_modified_since(self):
+        """Is a resource written since If-Modified-Since returned?"""
+        response = self.app.patch('/artists/1',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 204
+        response = self.get_response('/artists/1', 200,
+                headers={'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'})
+        assert json.loads(
+            response.get_data(as_text=True))[u'Name'] == u'Jeff Knupp'
+
+    def test_collection_last_modified(self):
+        """Does a collection carry a Last-Modified header?"""
+        response = self.get_response('/artists', 200, params={'page': 1})
+        assert 'Last-Modified' in response.headers
+
+    def test_if_none_match_takes_precedence(self):
+        """Is If-Modified-Since ignored in the presence of If-None-Match?"""
+        response = self.get_response('/artists/1', 200)
+        self.get_response('/artists/1', 200, headers={
+            'If-Modified-Since': response.headers['Last-Modified'],
+            'If-None-Match': '"foo"'})
+
+    def test_untracked_by_default(self):
+        """Is Last-Modified omitted unless writes are tracked?"""
+        app.config['SANDMAN_TRACK_LAST_MODIFIED'] = False
+        response = self.get_response('/artists/1', 200)
+        assert 'Last-Modified' not in response.headers
+
+class TestSandmanCacheControl(TestSandmanBase):
+    """Sandman tests related to Cache-Control policies"""
+
+    def setup_method(self, args):
+        super(TestSandmanCacheControl, self).setup_method(args)
+        from .models import Artist
+        Artist.__max_age__ = 60
+        Artist.__s_maxage__ = 300
+        Artist.__stale_while_revalidate__ = 30
+        Artist.__cache_scope__ = 'public'
+
+    def teardown_method(self, args):
+        from .models import Artist
+        Artist.__max_age__ = None
+        Artist.__s_maxage__ = None
+        Artist.__stale_while_revalidate__ = None
+        Artist.__cache_scope__ = None
+        app.config['SANDMAN_CACHE_CONTROL'] = {}
+        super(TestSandmanCacheControl, self).teardown_method(args)
+
+    def test_model_policy(self):
+        """Are a Model's directives applied to its resources?"""
+        for uri in ('/artists', '/artists/1', '/artists/1/Name',
+                '/artists/meta'):
+            response = self.get_response(uri, 200)
+            assert response.headers['Cache-Control'] == (
+                'public, max-age=60, s-maxage=300, stale-while-revalidate=30')
+
+    def test_no_policy_by_default(self):
+        """Are responses sent without Cache-Control by default?"""
+        response = self.get_response('/albums', 200)
+        assert 'Cache-Control' not in response.headers
+
+    def test_endpoint_policy(self):
+        """Do an endpoint's directives override the Model's?"""
+        app.config['SANDMAN_CACHE_CONTROL'] = {
+            'get_meta': {'max-age': 3600},
+            'get_resource': {'private': True}}
+        response = self.get_response('/artists/meta', 200)
+        assert 'max-age=3600' in response.headers['Cache-Control']
+        response = self.get_response('/artists/1', 200)
+        assert response.headers['Cache-Control'] == (
+            'private, max-age=60, s-maxage=300, stale-while-revalidate=30')
+
+    def test_not_modified_policy(self):
+        """Does a 304 carry the Cache-Control and Vary headers?"""
+        response = self.get_response('/artists/1', 200)
+        response = self.get_response('/artists/1', 304,
+                headers={'If-None-Match': response.headers['ETag']},
+                has_data=False)
+        assert 'max-age=60' in response.headers['Cache-Control']
+        assert response.headers['Vary'] == 'Accept'
+
+    def test_vary_accept(self):
+        """Do responses negotiated on Accept say so?"""
+        response = self.get_response('/albums', 200)
+        # Compression (on by default) also varies responses on
+        # Accept-Encoding
+        assert response.headers['Vary'] == 'Accept, Accept-Encoding'
+
+class TestSandmanCompression(TestSandmanBase):
+    """Sandman tests related to compressed responses"""
+
+    @staticmethod
+    def decompress(response):
+        """Return the gzip-compressed body of *response*."""
+        assert response.headers['Content-Encoding'] == 'gzip'
+        return zlib.decompress(response.get_data(), 16 + zlib.MAX_WBITS)
+
+    def test_gzip_collection(self):
+        """Is a collection compressed if the client accepts gzip?"""
+        response = self.get_response('/artists', 200, has_data=False,
+                headers={'Accept-Encoding': 'gzip'})
+        as_json = json.loads(self.decompress(response).decode('utf-8'))
+        assert len(as_json[u'resources']) == 275
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert response.headers['ETag'].startswith('W/')
+
+    def test_small_response_uncompressed(self):
+        """Are responses smaller than the minimum size left alone?"""
+        response = self.get_response('/artists/1/Name', 200,
+                headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+
+    def test_refused_encoding(self):
+        """Is a coding refused with q=0 never used?"""
+        response = self.get_response('/artists', 200,
+                headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        assert 'Content-Encoding' not in response.headers
+
+    def test_streamed_collection_compressed(self):
+        """Are streamed collections compressed as they are sent?"""
+        response = self.get_response('/artists', 200, has_data=False,
+                headers={'Accept': 'application/x-ndjson',
+                         'Accept-Encoding': 'gzip'})
+        lines = self.decompress(response).decode('utf-8').splitlines()
+        assert len(lines) == 275
+
+    def test_static_file_compressed(self):
+        """Are static files served compressed?"""
+        path = os.path.join(app.static_folder, 'css', 'bootstrap.min.css')
+        with open(path, 'rb') as static_file:
+            expected = static_file.read()
+        for _ in range(2):
+            response = self.get_response('/static/css/bootstrap.min.css', 200,
+                    has_data=False, headers={'Accept-Encoding': 'gzip'})
+            assert self.decompress(response) == expected
+        assert app.static_compression_cache.stats()['hits'] >= 1
+
+class TestSandmanBulkCreate(TestSandmanBase):
+    """Sandman tests related to creating many resources in one request"""
+
+    def teardown_method(self, args):
+        from .models import Artist
+        if 'validate_POST' in vars(Artist):
+            del Artist.validate_POST
+        app.config['SANDMAN_BULK_CHUNK_SIZE'] = 1000
+        super(TestSandmanBulkCreate, self).teardown_method(args)
+
+    def artist_count(self):
+        """Return the number of artists."""
+        response = self.get_response('/artists', 200)
+        return len(json.loads(response.get_data(as_text=True))[u'resources'])
+
+    def test_post_array(self):
+        """Is a resource created for each object in a JSON array?"""
+        app.config['SANDMAN_BULK_CHUNK_SIZE'] = 2
+        response = self.app.post('/artists',
+                content_type='application/json',
+                data=json.dumps([{u'Name': str(i)} for i in range(5)]))
+        assert response.status_code == 201
+        results = json.loads(response.get_data(as_text=True))[u'results']
+        assert [result[u'self'] for result in results] == [
+            '/artists/{}'.format(i) for i in range(276, 281)]
+        assert self.artist_count() == 280
+
+    def test_post_array_with_keys(self):
+        """Are the URIs of resources given their primary keys returned?"""
+        response = self.app.post('/artists',
+                content_type='application/json',
+                data=json.dumps([{u'ArtistId': i, u'Name': str(i)}
+                    for i in range(276, 279)]))
+        assert response.status_code == 201
+        results = json.loads(response.get_data(as_text=True))[u'results']
+        assert [result[u'self'] for result in results] == [
+            '/artists/{}'.format(i) for i in range(276, 279)]
+
+    def test_post_array_executemany(self):
+        """Is each chunk of resources given their primary keys inserted with
+        a single statement?"""
+        app.config['SANDMAN_BULK_CHUNK_SIZE'] = 2
+        statements = []
+        engine = db.get_engine(app)
+        #pylint: disable=too-many-arguments,unused-argument
+        def count(conn, cursor, statement, parameters, context, executemany):
+            """Record each INSERT sent to the database."""
+            if statement.startswith('INSERT'):
+                statements.append(executemany)
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            response = self.app.post('/artists',
+                    content_type='application/json',
+                    data=json.dumps([{u'ArtistId': i, u'Name': str(i)}
+                        for i in range(276, 281)]))
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert response.status_code == 201
+        assert statements == [True, True, False]
+
+    def test_post_ndjson(self):
+        """Is a resource created for each line of newline-delimited JSON?"""
+        response = self.app.post('/artists',
+                content_type='application/x-ndjson',
+                data='{"Name": "Jeff Knupp"}\n\n{"Name": "Knupp Jeff"}\n')
+        assert response.status_code == 201
+        assert self.artist_count() == 277
+
+    def test_post_array_validated(self):
+        """Are items failing validation reported and left out?"""
+        from .models import Artist
+        Artist.validate_POST = staticmethod(
+                lambda resource: resource.Name != u'Invalid')
+        response = self.app.post('/artists',
+                content_type='application/json',
+                data=json.dumps([{u'Name': u'Jeff Knupp'},
+                    {u'Name': u'Invalid'}, u'Not an object']))
+        assert response.status_code == 207
+        results = json.loads(response.get_data(as_text=True))[u'results']
+        assert [result[u'status'] for result in results] == [201, 403, 400]
+        assert self.artist_count() == 276
+
+    def test_post_invalid_ndjson(self):
+        """Is nothing created if a line isn't valid JSON?"""
+        response = self.app.post('/artists',
+                content_type='application/x-ndjson',
+                data='{"Name": "Jeff Knupp"}\n{"Name": \n')
+        assert response.status_code == 400
+        assert self.artist_count() == 275
+
+class TestSandmanFilteredWrites(TestSandmanBase):
+    """Sandman tests related to updating and deleting the resources matching
+    a filter"""
+
+    def test_filtered_delete(self):
+        """Are exactly the resources matching the filter deleted?"""
+        # Artists 28 to 35 have no albums
+        response = self.app.delete('/artists?ArtistId__gte=28&ArtistId__lte=35')
+        assert response.status_code == 200
+        assert json.loads(response.get_data(as_text=True))[u'affected'] == 8
+        response = self.get_response('/artists', 200)
+        assert len(json.loads(
+            response.get_data(as_text=True))[u'resources']) == 267
+
+    def test_filtered_delete_violating_constraint(self):
+        """Is deleting resources which are still referred to refused?"""
+        response = self.app.delete('/artists?ArtistId=1')
+        assert response.status_code == 422
+        self.get_response('/artists/1', 200)
+
+    def test_unfiltered_delete_refused(self):
+        """Is deleting a whole collection refused?"""
+        response = self.app.delete('/artists')
+        assert response.status_code == 400
+        response = self.app.delete('/artists?page=1')
+        assert response.status_code == 400
+
+    def test_filtered_patch(self):
+        """Are exactly the resources matching the filter updated?"""
+        response = self.app.patch('/artists?ArtistId__lte=3',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 200
+        assert json.loads(response.get_data(as_text=True))[u'affected'] == 3
+        response = self.get_response('/artists', 200,
+                params={'Name': 'Jeff Knupp'})
+        assert len(json.loads(
+            response.get_data(as_text=True))[u'resources']) == 3
+
+    def test_patch_unknown_column(self):
+        """Is updating a column that doesn't exist rejected?"""
+        response = self.app.patch('/artists?ArtistId=1',
+                content_type='application/json',
+                data=json.dumps({u'Foo': u'Jeff Knupp'}))
+        assert response.status_code == 400
+
+    def test_filtered_patch_invalidates_resources(self):
+        """Are the cached responses of the updated resources invalidated?"""
+        app.config['SANDMAN_RESPONSE_CACHE_SIZE'] = 100
+        app.response_cache = None
+        try:
+            self.get_response('/artists/1', 200)
+            self.app.patch('/artists?ArtistId=1',
+                    content_type='application/json',
+                    data=json.dumps({u'Name': u'Jeff Knupp'}))
+            response = self.get_response('/artists/1', 200)
+        finally:
+            app.config['SANDMAN_RESPONSE_CACHE_SIZE'] = 0
+            app.response_cache = None
+        assert json.loads(
+            response.get_data(as_text=True))[u'Name'] == u'Jeff Knupp'
+
+class TestSandmanBatch(TestSandmanBase):
+    """Sandman tests related to the batch endpoint"""
+
+    def batch(self, data, status_code=200):
+        """POST *data* to the batch endpoint and return its results, or its
+        whole body if it wasn't successful."""
+        response = self.app.post('/_batch',
+                content_type='application/json', data=json.dumps(data))
+        assert response.status_code == status_code
+        body = json.loads(response.get_data(as_text=True))
+        if status_code != 200:
+            return body
+        return body[u'results']
+
+    def artist_count(self):
+        """Return the number of artists."""
+        response = self.get_response('/artists', 200)
+        return len(json.loads(response.get_data(as_text=True))[u'resources'])
+
+    def test_batch_get(self):
+        """Are the results of each sub-request returned in order?"""
+        results = self.batch([
+            {u'method': u'GET', u'path': u'/artists/1'},
+            {u'method': u'GET', u'path': u'/albums/1?fields=Title'},
+            {u'method': u'GET', u'path': u'/artists/999999'}])
+        assert [result[u'status'] for result in results] == [200, 200, 404]
+        assert results[0][u'body'][u'Name'] == u'AC/DC'
+        assert results[1][u'body'][u'Title'] == (
+            u'For Those About To Rock We Salute You')
+
+    def test_batch_shares_identity_map(self):
+        """Is a resource loaded by one sub-request reused by the next?"""
+        statements = []
+        engine = db.get_engine(app)
+        #pylint: disable=too-many-arguments,unused-argument
+        def count(conn, cursor, statement, parameters, context, executemany):
+            """Record each statement sent to the database."""
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            self.batch([{u'method': u'GET', u'path': u'/artists/1'}] * 3)
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert len(statements) == 1
+
+    def test_batch_without_transaction(self):
+        """Are writes committed even if a later sub-request fails?"""
+        results = self.batch([
+            {u'method': u'POST', u'path': u'/artists',
+             u'body': {u'Name': u'Jeff Knupp'}},
+            {u'method': u'PUT', u'path': u'/tracks/999',
+             u'body': {u'TrackId': 999}}])
+        assert [result[u'status'] for result in results] == [201, 403]
+        assert self.artist_count() == 276
+
+    def test_batch_transaction_rolled_back(self):
+        """Does a failure roll back every write of a transaction?"""
+        body = self.batch({u'transaction': True, u'requests': [
+            {u'method': u'POST', u'path': u'/artists',
+             u'body': {u'Name': u'Jeff Knupp'}},
+            {u'method': u'PUT', u'path': u'/tracks/999',
+             u'body': {u'TrackId': 999}},
+            {u'method': u'GET', u'path': u'/artists/1'}]}, 403)
+        assert len(body[u'results']) == 2
+        assert self.artist_count() == 275
+
+    def test_batch_transaction_committed(self):
+        """Are the writes of a successful transaction committed?"""
+        results = self.batch({u'transaction': True, u'requests': [
+            {u'method': u'POST', u'path': u'/artists',
+             u'body': {u'Name': u'Jeff Knupp'}},
+            {u'method': u'POST', u'path': u'/artists',
+             u'body': {u'Name': u'Knupp Jeff'}}]})
+        assert [result[u'status'] for result in results] == [201, 201]
+        assert self.artist_count() == 277
+
+    def test_batch_not_compressed(self):
+        """Is a sub-request asking for a compressed body answered with a
+        plain one?"""
+        results = self.batch([{u'method': u'GET', u'path': u'/artists',
+                               u'headers': {u'Accept-Encoding': u'gzip'}}])
+        assert results[0][u'status'] == 200
+        assert len(results[0][u'body'][u'resources']) == 275
+
+    def test_nested_batch_refused(self):
+        """Is a batch within a batch refused?"""
+        self.batch([{u'method': u'POST', u'path': u'/_batch'}], 400)
+
+class TestSandmanGroupCommit(TestSandmanBase):
+    """Sandman tests related to committing concurrent writes together"""
+
+    def setup_method(self, args):
+        super(TestSandmanGroupCommit, self).setup_method(args)
+        app.config['SANDMAN_GROUP_COMMIT'] = True
+        app.config['SANDMAN_GROUP_COMMIT_WINDOW'] = 1
+        app.config['SANDMAN_GROUP_COMMIT_SIZE'] = 4
+        app.group_committer = None
+
+    def teardown_method(self, args):
+        app.config['SANDMAN_GROUP_COMMIT'] = False
+        app.group_committer = None
+        super(TestSandmanGroupCommit, self).teardown_method(args)
+
+    @staticmethod
+    def concurrently(*requests):
+        """Send each ``(method, uri, data)`` tuple in *requests* from its own
+        thread and return their status codes."""
+        status_codes = [None] * len(requests)
+        def send(index, method, uri, data):
+            """Send a request and record its status code."""
+            response = app.test_client().open(uri, method=method,
+                    content_type='application/json', data=json.dumps(data))
+            status_codes[index] = response.status_code
+        threads = [threading.Thread(target=send, args=(index,) + request)
+                for index, request in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return status_codes
+
+    def artist_count(self):
+        """Return the number of artists."""
+        response = self.get_response('/artists', 200)
+        return len(json.loads(response.get_data(as_text=True))[u'resources'])
+
+    def test_writes_committed_together(self):
+        """Are concurrent writes committed in a single transaction?"""
+        self.artist_count()
+        status_codes = self.concurrently(
+            *[('POST', '/artists', {u'Name': u'Jeff Knupp'})] * 4)
+        assert status_codes == [201] * 4
+        assert app.group_committer.commits == 1
+        assert self.artist_count() == 279
+
+    def test_error_attributed_to_request(self):
+        """Does a failing write fail only the request which sent it?"""
+        self.artist_count()
+        status_codes = self.concurrently(
+            ('POST', '/artists', {u'Name': u'Jeff Knupp'}),
+            ('PUT', '/albums/1', {u'Title': u'Jeff Knupp'}),
+            ('POST', '/artists', {u'Name': u'Knupp Jeff'}),
+            ('PATCH', '/artists/1', {u'Name': u'Jeff Knupp'}))
+        assert status_codes == [201, 422, 201, 204]
+        assert app.group_committer.commits == 1
+        assert self.artist_count() == 277
+        response = self.get_response('/artists/1', 200)
+        assert json.loads(
+            response.get_data(as_text=True))[u'Name'] == u'Jeff Knupp'
+
+class TestSandmanPatchFormats(TestSandmanBase):
+    """Sandman tests related to partial updates and patch formats"""
+
+    def patch(self, data, content_type='application/json', status_code=204):
+        """PATCH */tracks/1* with *data* and return the updated track."""
+        response = self.app.patch('/tracks/1',
+                content_type=content_type, data=json.dumps(data))
+        assert response.status_code == status_code
+        response = self.get_response('/tracks/1', 200)
+        return json.loads(response.get_data(as_text=True))
+
+    def test_falsy_values_written(self):
+        """Are falsy values such as 0 and "" written rather than dropped?"""
+        track = self.patch({u'Bytes': 0, u'Composer': u''})
+        assert track[u'Bytes'] == 0
+        assert track[u'Composer'] == u''
+
+    def test_only_changed_columns_updated(self):
+        """Does the UPDATE only set the columns sent?"""
+        statements = []
+        engine = db.get_engine(app)
+        #pylint: disable=too-many-arguments,unused-argument
+        def count(conn, cursor, statement, parameters, context, executemany):
+            """Record each statement sent to the database."""
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            self.patch({u'Bytes': 0})
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert 'Bytes' in statements[0]
+        assert 'Composer' not in statements[0]
+
+    def test_merge_patch_null_clears(self):
+        """Does ``null`` in a merge patch clear a column?"""
+        track = self.patch({u'Composer': None},
+                content_type='application/merge-patch+json')
+        assert track[u'Composer'] is None
+        assert track[u'Name'] == u'For Those About To Rock (We Salute You)'
+
+    def test_json_patch(self):
+        """Are the operations of a JSON Patch applied in order?"""
+        track = self.patch([
+            {u'op': u'test', u'path': u'/Name',
+             u'value': u'For Those About To Rock (We Salute You)'},
+            {u'op': u'replace', u'path': u'/Name', u'value': u'Jeff Knupp'},
+            {u'op': u'copy', u'from': u'/Composer', u'path': u'/Name'},
+            {u'op': u'remove', u'path': u'/Composer'}],
+            content_type='application/json-patch+json')
+        assert track[u'Name'] == u'Angus Young, Malcolm Young, Brian Johnson'
+        assert track[u'Composer'] is None
+
+    def test_json_patch_failed_test(self):
+        """Does a failed ``test`` leave the resource untouched?"""
+        track = self.patch([
+            {u'op': u'test', u'path': u'/Name', u'value': u'Jeff Knupp'},
+            {u'op': u'replace', u'path': u'/Name', u'value': u'Jeff Knupp'}],
+            content_type='application/json-patch+json', status_code=409)
+        assert track[u'Name'] == u'For Those About To Rock (We Salute You)'
+
+    def test_json_patch_invalid_path(self):
+        """Is a JSON Patch naming an unknown column rejected?"""
+        self.patch([{u'op': u'remove', u'path': u'/Jeff'}],
+            content_type='application/json-patch+json', status_code=400)
+
+class TestSandmanReflectionSnapshot(TestSandmanBase):
+    """Sandman tests related to snapshots of the reflected schema"""
+
+    SNAPSHOT_FILE = os.path.join(os.getcwd(), 'tests', 'snapshot.pickle')
+
+    def teardown_method(self, args):
+        if os.path.exists(self.SNAPSHOT_FILE):
+            os.unlink(self.SNAPSHOT_FILE)
+        super(TestSandmanReflectionSnapshot, self).teardown_method(args)
+
+    def test_snapshot_round_trip(self):
+        """Does a saved snapshot load with its tables and foreign keys?"""
+        engine = db.get_engine(app)
+        ReflectionSnapshot.take(engine).save(self.SNAPSHOT_FILE)
+        snapshot = ReflectionSnapshot.load(self.SNAPSHOT_FILE, engine)
+        assert 'Track' in snapshot.metadata.tables
+        assert [foreign_key['referred_table'] for foreign_key in
+                snapshot.foreign_keys['Album']] == ['Artist']
+        metadata = MetaData()
+        snapshot.restore(metadata)
+        assert 'Name' in metadata.tables['Artist'].columns
+
+    def test_stale_snapshot_ignored(self):
+        """Is a snapshot of a different schema ignored?"""
+        engine = db.get_engine(app)
+        ReflectionSnapshot.take(engine).save(self.SNAPSHOT_FILE)
+        engine.execute('CREATE TABLE snapshot_test (id INTEGER PRIMARY KEY)')
+        assert ReflectionSnapshot.load(self.SNAPSHOT_FILE, engine) is None
+
+    def test_missing_snapshot_ignored(self):
+        """Is a missing snapshot file ignored?"""
+        assert ReflectionSnapshot.load(
+            self.SNAPSHOT_FILE, db.get_engine(app)) is None
+
+class TestSandmanLazyReflection(TestSandmanBase):
+    """Sandman tests related to reflecting tables on their first request"""
+
+    def setup_method(self, args):
+        super(TestSandmanLazyReflection, self).setup_method(args)
+        #pylint: disable=attribute-defined-outside-init
+        self.class_references = app.class_references.copy()
+        _prepare_lazy_reflection(db)
+
+    def teardown_method(self, args):
+        app.class_references = self.class_references
+        app.lazy_tables = None
+        super(TestSandmanLazyReflection, self).teardown_method(args)
+
+    def test_table_reflected_on_first_request(self):
+        """Is an unregistered table reflected when it is first requested?"""
+        assert 'customers' not in app.class_references
+        response = self.get_response('/customers', 200)
+        assert len(json.loads(
+            response.get_data(as_text=True))[u'resources']) == 59
+        assert 'customers' in app.class_references
+
+    def test_registered_table_not_reflected(self):
+        """Is a table which already has a registered class left to it?"""
+        assert 'Genre' not in app.lazy_tables
+        assert 'genres' not in app.lazy_tables
+        self.get_response('/styles', 200)
+
+    def test_referred_tables_registered(self):
+        """Are the tables a lazily reflected table refers to registered
+        too?"""
+        self.get_response('/invoices/1', 200)
+        assert 'customers' in app.class_references
+        assert 'employees' in app.class_references
+
+    def test_unknown_table(self):
+        """Is an unknown endpoint still a 404?"""
+        self.get_response('/jeffs', 404, False)
+
+    def test_activate_lazy(self):
+        """Is a lazily reflected resource which is still referred to kept
+        from being deleted, as it is when every table is reflected?"""
+        activate(admin=False, browser=False, reflect_all=True, lazy=True)
+        assert 'customers' not in app.class_references
+        response = self.app.delete('/customers/1')
+        assert response.status_code == 422
+        assert 'invoices' in app.class_references
+        self.get_response('/customers/1', 200)
+
+    def test_reflected_in_batch_transaction(self):
+        """Does reflecting a table keep the session of the request which
+        requested it?"""
+        response = self.app.post('/_batch', content_type='application/json',
+                data=json.dumps({u'transaction': True, u'requests': [
+                    {u'method': u'POST', u'path': u'/artists',
+                     u'body': {u'Name': u'Jeff Knupp'}},
+                    {u'method': u'GET', u'path': u'/customers/1'},
+                    {u'method': u'POST', u'path': u'/artists',
+                     u'body': {u'Name': u'Knupp Jeff'}}]}))
+        assert response.status_code == 200
+        response = self.get_response('/artists', 200)
+        assert len(json.loads(
+            response.get_data(as_text=True))[u'resources']) == 277
+
+class TestSandmanQueryCount(TestSandmanBase):
+    """Sandman tests guarding against redundant database queries"""
+
+    def setup_method(self, args):
+        super(TestSandmanQueryCount, self).setup_method(args)
+        self.statements = []
+        self.engine = db.get_engine(app)
+        event.listen(self.engine, 'before_cursor_execute', self.count)
+
+    def teardown_method(self, args):
+        event.remove(self.engine, 'before_cursor_execute', self.count)
+        super(TestSandmanQueryCount, self).teardown_method(args)
+
+    #pylint: disable=too-many-arguments
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        """Record each statement sent to the database."""
+        self.statements.append(statement)
+
+    def test_collection_foreign_keys_not_queried(self):
+        """Are related resources left unqueried when they aren't expanded?"""
+        response = self.get_response('/tracks', 200, params={'page': 0})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert as_json['resources'][0]['album_url'] == '/Album/1'
+        assert len(self.statements) == 1
+
+    def test_fields_projected_into_select(self):
+        """Are columns left out of ``fields`` left out of the SELECT?"""
+        self.get_response('/tracks', 200,
+                params={'page': 0, 'fields': 'Name'})
+        assert len(self.statements) == 1
+        assert 'Composer' not in self.statements[0]
+
+    def test_patch_existing_single_statement(self):
+        """Is an existing resource PATCHed with a single UPDATE?"""
+        response = self.app.patch('/artists/275',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 204
+        assert len(self.statements) == 1
+        assert self.statements[0].startswith('UPDATE')
+
+    def test_patch_new_without_select_first(self):
+        """Is a new resource PATCHed without reading it first?"""
+        response = self.app.patch('/artists/276',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 201
+        # UPDATE, INSERT, and the SELECT rendering the created resource
+        assert [statement.split()[0] for statement in self.statements] == [
+            'UPDATE', 'INSERT', 'SELECT']
+
+    def test_put_single_statement(self):
+        """Is a resource PUT with a single UPDATE when its Model has no
+        validator?"""
+        response = self.app.put('/artists/239',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 204
+        assert len(self.statements) == 1
+        assert self.statements[0].startswith('UPDATE')
+        response = self.get_response('/artists/239', 200)
+        assert json.loads(
+                response.get_data(as_text=True))[u'Name'] == u'Jeff Knupp'
+
+    def test_put_unknown_single_statement(self):
+        """Is PUTting a resource that doesn't exist a 404 after a single
+        UPDATE?"""
+        response = self.app.put('/artists/404',
+                content_type='application/json',
+                data=json.dumps({u'Name': u'Jeff Knupp'}))
+        assert response.status_code == 404
+        assert len(self.statements) == 1
+
+    def test_delete_single_statement(self):
+        """Is a resource DELETEd with a single statement when its Model has
+        no validator and no registered table refers to it?"""
+        response = self.app.delete('/tracks/3503')
+        assert response.status_code == 204
+        assert len(self.statements) == 1
+        assert self.statements[0].startswith('DELETE')
+
+    def test_delete_referenced_loaded_first(self):
+        """Is a resource which other tables refer to loaded before it is
+        DELETEd, so that deleting it while it is referred to fails?"""
+        response = self.app.delete('/artists/1')
+        assert response.status_code == 422
+        assert self.statements[0].startswith('SELECT')
+
+    def test_expanded_collection_batch_loaded(self):
+        """Are related resources loaded with one query per foreign key?"""
+        response = self.get_response('/tracks', 200,
+                params={'page': 0, 'expand': 1})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert 'album' in as_json['resources'][0]
+        # Track, plus one query each for Album, MediaType and Genre
+        assert len(self.statements) == 4
+
+    def test_expanded_path_batch_loaded(self):
+        """Are nested expansion paths loaded with one query per level?"""
+        response = self.get_response('/tracks', 200,
+                params={'page': 0, 'expand': 'album.artist'})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert as_json['resources'][0]['album']['artist']['Name'] == 'AC/DC'
+        assert 'mediatype_url' in as_json['resources'][0]
+        # Track, Album and Artist
+        assert len(self.statements) == 3
+
+    def test_expanded_depth_batch_loaded(self):
+        """Is a numeric expansion depth loaded with one query per foreign key
+        and level?"""
+        response = self.get_response('/tracks', 200,
+                params={'page': 0, 'expand': 2})
+        as_json = json.loads(response.get_data(as_text=True))
+        assert as_json['resources'][0]['album']['artist']['Name'] == 'AC/DC'
+        # Track, Album, MediaType, Genre and Artist
+        assert len(self.statements) == 5
+
 class TestSandmanContentTypes(TestSandmanBase):
     """Sandman tests related to content types"""
 
@@ -371,6 +1592,34 @@ class TestSandmanContentTypes(TestSandmanBase):
                 headers={'Accept': 'application/json'})
         assert len(json.loads(response.get_data(as_text=True))[u'resources']) == 275
 
+    def test_get_ndjson_collection(self):
+        """Test getting a collection as newline-delimited JSON."""
+        response = self.get_response('/artists',
+                200,
+                headers={'Accept': 'application/x-ndjson'})
+        assert response.headers['Content-type'].startswith('application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        assert len(lines) == 275
+        assert json.loads(lines[0])[u'Name'] == u'AC/DC'
+
+    def test_get_csv_collection(self):
+        """Test getting a collection as CSV."""
+        response = self.get_response('/artists',
+                200,
+                headers={'Accept': 'text/csv'})
+        assert response.headers['Content-type'].startswith('text/csv')
+        lines = response.get_data(as_text=True).splitlines()
+        assert len(lines) == 276
+        assert lines[0] == 'ArtistId,Name'
+        assert lines[1] == '1,AC/DC'
+
+    def test_get_csv_validated_collection(self):
+        """Test getting a collection with a ``validate_GET`` hook as CSV."""
+        response = self.get_response('/styles',
+                200,
+                headers={'Accept': 'text/csv'})
+        assert len(response.get_data(as_text=True).splitlines()) == 26
+
     def test_get_unknown_url(self):
         """Test sending a GET request to a URL that would match the
         URL patterns of the API but is not a valid endpoint (e.g. 'foo/bar')."""